@@ -0,0 +1,232 @@
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import threading
+import urllib.request
+
+from sqlalchemy import func
+
+from database import SessionLocal, Alert, AlertRule, AlertEvent
+from shared import watch, changed
+
+# A condition that fired stays quiet for this long even if it clears and re-triggers
+ALERT_COOLDOWN = float(os.getenv('ALERT_COOLDOWN', '3600'))
+# Optional local sink that receives every firing as a JSON POST
+ALERT_WEBHOOK_URL = os.getenv('ALERT_WEBHOOK_URL')
+WEBHOOK_TIMEOUT = 5
+
+RULE_KINDS = ('rsi_above', 'rsi_below', 'ma_cross_above', 'ma_cross_below')
+MA_FAST = 'ma_50'
+MA_SLOW = 'ma_250'
+
+_lock = threading.Lock()
+_highs = {}  # symbol -> sorted high thresholds
+_lows = {}  # symbol -> sorted low thresholds
+_rules = {}  # symbol -> [(kind, value)]
+_active = set()  # (symbol, kind, threshold) currently in triggered state
+_seen = set()  # (symbol, kind, threshold) evaluated at least once by this process
+_last_fired = {}  # (symbol, kind, threshold) -> datetime
+_loaded = False
+_relayed = None  # last event id relay_events() passed on
+_listeners = []
+_webhook_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alert-webhook')
+
+def on_alert(callback):
+    """Call callback(event) for every alert firing"""
+    _listeners.append(callback)
+
+def invalidate_alerts():
+    """Thresholds or rules changed; every worker reloads them before its next evaluation"""
+    _reload()
+    changed('alerts')
+
+def _reload():
+    global _loaded
+    _loaded = False
+
+watch('alerts', _reload)
+
+def _load(db):
+    global _loaded
+    _highs.clear()
+    _lows.clear()
+    _rules.clear()
+    for symbol, high, low in db.query(Alert.symbol, Alert.high, Alert.low):
+        if high:
+            insort(_highs.setdefault(symbol, []), high)
+        if low:
+            insort(_lows.setdefault(symbol, []), low)
+    for symbol, kind, value in db.query(AlertRule.symbol, AlertRule.kind, AlertRule.value):
+        _rules.setdefault(symbol, []).append((kind, value))
+
+    # Firings from before a restart still count towards the cooldown
+    since = datetime.utcnow() - timedelta(seconds=ALERT_COOLDOWN)
+    recent = db.query(AlertEvent.symbol, AlertEvent.kind, AlertEvent.threshold, AlertEvent.triggered_at) \
+        .filter(AlertEvent.triggered_at >= since)
+    for symbol, kind, threshold, triggered_at in recent:
+        key = (symbol, kind, threshold)
+        if key not in _last_fired or triggered_at > _last_fired[key]:
+            _last_fired[key] = triggered_at
+    _loaded = True
+
+def _value(m, name):
+    value = m.get(name)
+    return None if value is None or math.isnan(value) else value
+
+def _conditions(symbol):
+    """Every condition configured for one symbol: [(symbol, kind, threshold)]"""
+    keys = [(symbol, 'high', t) for t in _highs.get(symbol, ())]
+    keys += [(symbol, 'low', t) for t in _lows.get(symbol, ())]
+    keys += [(symbol, kind, None if kind.startswith('ma_') else level) for kind, level in _rules.get(symbol, ())]
+    return keys
+
+def _triggered(symbol, m):
+    """Conditions that currently hold for one symbol: [(kind, threshold, value)]"""
+    hits = []
+    price = _value(m, 'price')
+    if price is not None:
+        # Every high at or below the price and every low at or above it
+        highs = _highs.get(symbol, [])
+        hits += [('high', t, price) for t in highs[:bisect_right(highs, price)]]
+        lows = _lows.get(symbol, [])
+        hits += [('low', t, price) for t in lows[bisect_left(lows, price):]]
+
+    rsi = _value(m, 'rsi')
+    fast, slow = _value(m, MA_FAST), _value(m, MA_SLOW)
+    for kind, level in _rules.get(symbol, ()):
+        if kind == 'rsi_above' and rsi is not None and level is not None and rsi > level:
+            hits.append((kind, level, rsi))
+        elif kind == 'rsi_below' and rsi is not None and level is not None and rsi < level:
+            hits.append((kind, level, rsi))
+        elif kind == 'ma_cross_above' and fast is not None and slow is not None and fast > slow:
+            hits.append((kind, None, fast))
+        elif kind == 'ma_cross_below' and fast is not None and slow is not None and fast < slow:
+            hits.append((kind, None, fast))
+    return hits
+
+def _message(symbol, kind, threshold, value):
+    if kind == 'high':
+        return f"{symbol} at {value:.2f}, above {threshold:.2f}"
+    if kind == 'low':
+        return f"{symbol} at {value:.2f}, below {threshold:.2f}"
+    if kind == 'rsi_above':
+        return f"{symbol} RSI {value:.1f} crossed above {threshold:g}"
+    if kind == 'rsi_below':
+        return f"{symbol} RSI {value:.1f} crossed below {threshold:g}"
+    if kind == 'ma_cross_above':
+        return f"{symbol} MA50 crossed above MA250"
+    return f"{symbol} MA50 crossed below MA250"
+
+def evaluate_alerts(metrics):
+    """Check every alert against {symbol: indicator metrics}; returns the events that fired
+
+    Conditions are edge-triggered: one event when a condition starts to
+    hold (a price crossing its threshold, RSI crossing its level, MA50
+    crossing MA250), nothing while it keeps holding, and at most one event
+    per condition every ALERT_COOLDOWN seconds. A condition that already
+    holds the first time it is evaluated (new rule, restart, leader
+    takeover) is recorded as active without firing.
+    """
+    with _lock:
+        db = SessionLocal()
+        try:
+            if not _loaded:
+                _load(db)
+
+            now = datetime.utcnow()
+            active = {key for key in _active if key[0] not in metrics}
+            fired = []
+            for symbol, m in metrics.items():
+                if symbol not in _highs and symbol not in _lows and symbol not in _rules:
+                    continue
+                for kind, threshold, value in _triggered(symbol, m):
+                    key = (symbol, kind, threshold)
+                    active.add(key)
+                    if key in _active or key not in _seen:
+                        continue
+                    last = _last_fired.get(key)
+                    if last is not None and (now - last).total_seconds() < ALERT_COOLDOWN:
+                        continue
+                    _last_fired[key] = now
+                    fired.append(AlertEvent(symbol=symbol, kind=kind, threshold=threshold,
+                                            value=float(value), triggered_at=now))
+                _seen.update(_conditions(symbol))
+            _active.clear()
+            _active.update(active)
+
+            if fired:
+                db.add_all(fired)
+                db.commit()
+            events = [event_dict(e) for e in fired]
+        finally:
+            db.close()
+
+    for event in events:
+        print(f"🔔 {event['message']}")
+        _notify(event)
+        if ALERT_WEBHOOK_URL:
+            _webhook_pool.submit(_post_webhook, event)
+    return events
+
+def relay_events():
+    """Pass events another worker persisted since the last call to this worker's listeners
+
+    Workers that do not evaluate alerts use this so their own streams still
+    get every firing; the webhook is only called by the evaluating worker.
+    """
+    global _relayed
+    with _lock:
+        db = SessionLocal()
+        try:
+            if _relayed is None:
+                _relayed = db.query(func.max(AlertEvent.id)).scalar() or 0
+                return []
+            events = [event_dict(e) for e in db.query(AlertEvent).filter(AlertEvent.id > _relayed).order_by(AlertEvent.id)]
+        finally:
+            db.close()
+        if events:
+            _relayed = events[-1]['id']
+
+    for event in events:
+        _notify(event)
+    return events
+
+def _notify(event):
+    for callback in _listeners:
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"Alert listener failed: {e}")
+
+def _post_webhook(event):
+    request = urllib.request.Request(
+        ALERT_WEBHOOK_URL,
+        data=json.dumps(event).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT):
+            pass
+    except Exception as e:
+        print(f"Alert webhook failed: {e}")
+
+def event_dict(event: AlertEvent):
+    return {
+        "id": event.id,
+        "symbol": event.symbol,
+        "kind": event.kind,
+        "threshold": event.threshold,
+        "value": round(event.value, 2) if event.value is not None else None,
+        "triggered_at": event.triggered_at.isoformat(),
+        "message": _message(event.symbol, event.kind, event.threshold, event.value)
+    }
+
+def recent_events(db, symbol=None, limit=50):
+    query = db.query(AlertEvent)
+    if symbol:
+        query = query.filter(AlertEvent.symbol == symbol)
+    return [event_dict(e) for e in query.order_by(AlertEvent.triggered_at.desc(), AlertEvent.id.desc()).limit(limit)]
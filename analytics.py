@@ -0,0 +1,266 @@
+from collections import deque
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import threading
+
+from database import Transaction
+from indicators import TRADING_DAYS
+from market_data import history_generation, load_bar_matrices, OVERLAP_DAYS
+from screener import current_snapshot
+from shared import generation
+
+# Daily returns used for the correlation/covariance matrix
+CORRELATION_WINDOW = 252
+CORRELATION_MIN_PERIODS = 20
+
+_cache_lock = threading.Lock()
+_cache = {'key': None, 'result': None}
+# Close matrix kept between computations; only its tail is re-read when bars arrive
+_closes = {'generation': None, 'symbols': frozenset(), 'start': None, 'frame': None}
+
+def _load_trades(db: Session):
+    rows = db.query(
+        Transaction.symbol, Transaction.transaction_type, Transaction.quantity, Transaction.price, Transaction.date
+    ).filter(Transaction.transaction_type.in_(['BUY', 'SELL'])).order_by(Transaction.date, Transaction.id).all()
+    return pd.DataFrame(rows, columns=['symbol', 'type', 'quantity', 'price', 'date'])
+
+def _load_closes(db: Session, symbols, start):
+    return load_bar_matrices(db, symbols, start, ['close'])['close']
+
+def close_matrix(db: Session, symbols, start):
+    """Close matrix for the book, re-reading only the last OVERLAP_DAYS once loaded
+
+    The full history is read again when the symbols or start date are not
+    covered, or when market_data reports a backfill or re-adjustment.
+    """
+    generation = history_generation()
+    cached = _closes['frame']
+    if (cached is None or cached.empty or _closes['generation'] != generation
+            or not set(symbols) <= _closes['symbols'] or start < _closes['start']):
+        frame = _load_closes(db, symbols, start)
+        _closes.update(generation=generation, symbols=frozenset(symbols), start=start, frame=frame)
+        return frame
+
+    cached_symbols = list(cached.columns)
+    tail_start = (cached.index.max() - timedelta(days=OVERLAP_DAYS)).date() if len(cached) else _closes['start']
+    tail = _load_closes(db, cached_symbols, tail_start)
+    frame = pd.concat([cached[cached.index < pd.Timestamp(tail_start)], tail])
+    _closes['frame'] = frame
+    return frame.loc[frame.index >= pd.Timestamp(start), symbols]
+
+def fifo_positions(trades: pd.DataFrame, last_prices):
+    """Per-symbol FIFO lots: open quantity, lot cost, realized and unrealized P&L"""
+    book = {}
+    columns = (trades[c].tolist() for c in ('symbol', 'type', 'quantity', 'price'))
+    for symbol, kind, quantity, price in zip(*columns):
+        lots, realized = book.setdefault(symbol, (deque(), [0.0]))
+        if kind == 'BUY':
+            lots.append([quantity, price])
+            continue
+        remaining = quantity
+        while remaining > 1e-12 and lots:
+            lot = lots[0]
+            matched = min(lot[0], remaining)
+            realized[0] += matched * (price - lot[1])
+            lot[0] -= matched
+            remaining -= matched
+            if lot[0] <= 1e-12:
+                lots.popleft()
+
+    positions = {}
+    for symbol in sorted(book):
+        lots, (realized,) = book[symbol]
+        quantity = sum(q for q, _ in lots)
+        cost = sum(q * p for q, p in lots)
+        last = last_prices.get(symbol)
+        value = quantity * last if last is not None else None
+        positions[symbol] = {
+            'quantity': round(quantity, 4),
+            'open_lots': len(lots),
+            'cost': round(cost, 2),
+            'last_price': round(last, 2) if last is not None else None,
+            'market_value': round(value, 2) if value is not None else None,
+            'realized_pnl': round(realized, 2),
+            'unrealized_pnl': round(value - cost, 2) if value is not None else None,
+        }
+    return positions
+
+def xirr(days, amounts):
+    """Annualized money-weighted return for cash flows at day offsets (NaN if it has no root)"""
+    years = np.asarray(days, dtype=float) / 365.25
+    amounts = np.asarray(amounts, dtype=float)
+    if not (amounts > 0).any() or not (amounts < 0).any():
+        return np.nan
+
+    def npv(rate):
+        return (amounts / (1 + rate) ** years).sum()
+
+    # Newton from 10%, falling back to bisection on a bracketing interval
+    rate = 0.1
+    for _ in range(50):
+        discount = (1 + rate) ** years
+        value = (amounts / discount).sum()
+        slope = (-years * amounts / (discount * (1 + rate))).sum()
+        if slope == 0:
+            break
+        step = value / slope
+        rate -= step
+        if rate <= -0.9999:
+            break
+        if abs(step) < 1e-10:
+            return rate
+
+    low, high = -0.9999, 10.0
+    if np.sign(npv(low)) == np.sign(npv(high)):
+        return np.nan
+    for _ in range(200):
+        mid = (low + high) / 2
+        if np.sign(npv(mid)) == np.sign(npv(low)):
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+def equity_curve(trades: pd.DataFrame, closes: pd.DataFrame):
+    """Daily market value, net invested and time-weighted return index
+
+    Positions and flows are scattered onto the trading calendar (trades on
+    non-trading days count from the next session) and accumulated with one
+    cumulative sum; every day's value is a row-wise dot product with the
+    forward-filled close matrix. External flows are assumed at the start of
+    the day, so r_t = V_t / (V_{t-1} + F_t) - 1.
+    """
+    dates = closes.index
+    symbols = list(closes.columns)
+    column = {symbol: i for i, symbol in enumerate(symbols)}
+
+    day = np.minimum(dates.searchsorted(pd.DatetimeIndex(trades['date']).normalize()), len(dates) - 1)
+    sign = np.where(trades['type'].to_numpy() == 'BUY', 1.0, -1.0)
+    quantity = trades['quantity'].to_numpy(dtype=float) * sign
+    flow = quantity * trades['price'].to_numpy(dtype=float)
+
+    holdings = np.zeros((len(dates), len(symbols)))
+    np.add.at(holdings, (day, trades['symbol'].map(column).to_numpy()), quantity)
+    holdings = np.cumsum(holdings, axis=0)
+    flows = np.zeros(len(dates))
+    np.add.at(flows, day, flow)
+
+    # Symbols without a bar yet are valued at their last trade price
+    last_trade = trades.groupby('symbol')['price'].last().reindex(symbols).to_numpy(dtype=float)
+    prices = closes.ffill().bfill().to_numpy(dtype=float)
+    prices = np.nan_to_num(np.where(np.isnan(prices), last_trade, prices))
+    value = (holdings * prices).sum(axis=1)
+
+    previous = np.concatenate(([0.0], value[:-1]))
+    base = previous + flows
+    returns = np.divide(value, base, out=np.ones_like(value), where=base > 1e-9) - 1
+    return pd.DataFrame({
+        'value': value,
+        'flow': flows,
+        'net_invested': np.cumsum(flows),
+        'return': returns,
+        'index': np.cumprod(1 + returns),
+    }, index=dates)
+
+def max_drawdown(index: pd.Series):
+    peak = index.cummax()
+    drawdown = index / peak - 1
+    trough = drawdown.idxmin()
+    return {
+        'max_drawdown_pct': round(float(drawdown.min()) * 100, 2),
+        'peak_date': index.loc[:trough].idxmax().date().isoformat(),
+        'trough_date': trough.date().isoformat(),
+    }
+
+def correlation(closes: pd.DataFrame, symbols):
+    """Correlation and annualized covariance of daily returns over the last CORRELATION_WINDOW days"""
+    window = closes[symbols].iloc[-(CORRELATION_WINDOW + 1):]
+    returns = window.pct_change(fill_method=None).iloc[1:]
+    returns = returns.loc[:, returns.count() >= CORRELATION_MIN_PERIODS]
+
+    def matrix(frame):
+        values = np.round(frame.to_numpy(dtype=float), 4)
+        cells = values.astype(object)
+        cells[np.isnan(values)] = None
+        return cells.tolist()
+
+    return {
+        'symbols': list(returns.columns),
+        'correlation': matrix(returns.corr(min_periods=CORRELATION_MIN_PERIODS)),
+        'covariance': matrix(returns.cov(min_periods=CORRELATION_MIN_PERIODS) * TRADING_DAYS),
+    }
+
+def compute_analytics(db: Session):
+    trades = _load_trades(db)
+    if trades.empty:
+        return {'status': 'empty'}
+
+    symbols = sorted(trades['symbol'].unique())
+    first_day = trades['date'].min().normalize()
+    # A few days before the first trade so it has a close to be valued at
+    closes = close_matrix(db, symbols, (first_day - timedelta(days=7)).date())
+    if closes.empty:
+        closes = pd.DataFrame(index=pd.DatetimeIndex([first_day]), columns=symbols, dtype=float)
+    closes = closes.iloc[max(closes.index.searchsorted(first_day, side='right') - 1, 0):]
+
+    curve = equity_curve(trades, closes)
+    last_prices = closes.ffill().iloc[-1].dropna().to_dict()
+    positions = fifo_positions(trades, last_prices)
+
+    days = (curve.index - curve.index[0]).days
+    cash_flows = -curve['flow'].to_numpy()
+    cash_flows[-1] += curve['value'].iloc[-1]
+    twr = curve['index'].iloc[-1] - 1
+    span = max(days[-1], 1)
+    mwr = xirr(days, cash_flows)
+
+    realized = sum(p['realized_pnl'] for p in positions.values())
+    unrealized = sum(p['unrealized_pnl'] or 0 for p in positions.values())
+    held = [s for s, p in positions.items() if p['quantity'] > 0 and s in last_prices]
+
+    return {
+        'status': 'ok',
+        'as_of': curve.index[-1].date().isoformat(),
+        'summary': {
+            'market_value': round(float(curve['value'].iloc[-1]), 2),
+            'net_invested': round(float(curve['net_invested'].iloc[-1]), 2),
+            'realized_pnl': round(realized, 2),
+            'unrealized_pnl': round(unrealized, 2),
+            'twr_pct': round(float(twr) * 100, 2),
+            'twr_annualized_pct': round(float((1 + twr) ** (365.25 / span) - 1) * 100, 2) if span >= 365 else None,
+            'mwr_annualized_pct': round(float(mwr) * 100, 2) if not np.isnan(mwr) else None,
+            'volatility_pct': round(float(curve['return'].iloc[1:].std() * np.sqrt(TRADING_DAYS)) * 100, 2)
+                              if len(curve) > 2 else None,
+            **max_drawdown(curve['index']),
+        },
+        'equity_curve': {
+            'dates': [d.date().isoformat() for d in curve.index],
+            'value': np.round(curve['value'].to_numpy(), 2).tolist(),
+            'net_invested': np.round(curve['net_invested'].to_numpy(), 2).tolist(),
+            'twr_index': np.round(curve['index'].to_numpy(), 6).tolist(),
+        },
+        'positions': positions,
+        'correlation': correlation(closes, held) if len(held) > 1 else None,
+    }
+
+def portfolio_analytics(db: Session):
+    """Portfolio analytics, cached until a transaction changes or a new snapshot (new bars) is published
+
+    Every transaction write through the API bumps the 'transactions'
+    generation; count and last id also catch writes made outside it (a
+    direct import), though not a delete and re-add that reuses the rowid.
+    """
+    count, last_id = db.query(func.count(Transaction.id), func.max(Transaction.id)).one()
+    snapshot = current_snapshot()
+    # created_at too: a worker's own merged snapshot can share a version number with the leader's next one
+    key = (generation('transactions'), count, last_id, snapshot.version, snapshot.created_at)
+    with _cache_lock:
+        if _cache['key'] == key:
+            return _cache['result']
+        result = compute_analytics(db)
+        _cache['key'] = key
+        _cache['result'] = result
+        return result
@@ -0,0 +1,242 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import pandas as pd
+import os
+import re
+import threading
+import time
+
+from market_data import load_bar_matrices
+
+# Forward returns reported for every signal, in bars
+DEFAULT_HORIZONS = (5, 20, 60)
+MAX_SIGNALS = 1000
+# Universes at least this large are split across worker processes; below it
+# the vectorized pass is faster than shipping the matrices to workers
+BACKTEST_WORKERS = int(os.getenv('BACKTEST_WORKERS', str(min(4, os.cpu_count() or 1))))
+BACKTEST_PARALLEL_MIN = int(os.getenv('BACKTEST_PARALLEL_MIN', '1000'))
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+COMPARISONS = ('<=', '>=', '<', '>')
+TOKEN = re.compile(r'\s*(crosses\s+above|crosses\s+below|<=|>=|<|>|and\b|&|,|[A-Za-z_]\w*|-?\d+(?:\.\d+)?)', re.I)
+SERIES = re.compile(r'^(price|open|high|low|close|volume|rsi|avg_volume)$|^(ma|sma|ema|rsi|perf|high|low)(\d+)$')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def parse_rule(rule):
+    """Parse "close crosses above ma50 and rsi < 40" into [(left, op, right)]
+
+    Operands are numbers or series: open/high/low/close/volume, price,
+    maN/smaN, emaN, rsi/rsiN, perfN (N-bar % change), highN/lowN (N-bar
+    extremes) and avg_volume. Operators are <, <=, >, >=, crosses above
+    and crosses below; conditions are joined with and / & / commas.
+    """
+    tokens = []
+    position = 0
+    rule = rule.strip()
+    while position < len(rule):
+        match = TOKEN.match(rule, position)
+        if not match:
+            raise ValueError(f"Cannot parse rule near: {rule[position:]}")
+        tokens.append(re.sub(r'\s+', ' ', match.group(1).lower()))
+        position = match.end()
+
+    conditions = []
+    current = []
+    for token in tokens + ['and']:
+        if token in ('and', '&', ','):
+            if len(current) != 3:
+                raise ValueError(f"Expected '<operand> <operator> <operand>', got: {' '.join(current) or 'nothing'}")
+            left, op, right = current
+            if op not in COMPARISONS + ('crosses above', 'crosses below'):
+                raise ValueError(f"Unknown operator: {op}")
+            conditions.append((_operand(left), op, _operand(right)))
+            current = []
+        else:
+            current.append(token)
+    return conditions
+
+def _operand(token):
+    try:
+        return float(token)
+    except ValueError:
+        pass
+    match = SERIES.match(token)
+    if not match:
+        raise ValueError(f"Unknown series: {token}")
+    if match.group(3) is not None and int(match.group(3)) < 1:
+        raise ValueError(f"Window must be positive: {token}")
+    return token
+
+def _compact_order(close):
+    # Each symbol's bars moved to the bottom of its column so shifts and windows step over calendar gaps
+    return np.argsort(~np.isnan(close), axis=0, kind='stable')
+
+def _rolling_mean(values, window):
+    return pd.DataFrame(values).rolling(window, min_periods=window).mean().to_numpy()
+
+def _rsi(close, window):
+    delta = np.diff(close, axis=0, prepend=np.nan)
+    gain = _rolling_mean(np.where(delta > 0, delta, np.where(np.isnan(delta), np.nan, 0.0)), window)
+    loss = _rolling_mean(np.where(delta < 0, -delta, np.where(np.isnan(delta), np.nan, 0.0)), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - 100 / (1 + gain / loss)
+    return np.where((loss == 0) & ~np.isnan(gain), 100.0, rsi)
+
+def _series(name, bars, cache):
+    if name in cache:
+        return cache[name]
+    close = bars['close']
+    match = SERIES.match(name)
+    plain, kind, window = match.group(1), match.group(2), match.group(3)
+    if plain == 'price':
+        values = close
+    elif plain in BAR_FIELDS:
+        values = bars[plain]
+    elif plain == 'rsi':
+        values = _rsi(close, 14)
+    elif plain == 'avg_volume':
+        values = _rolling_mean(bars['volume'], 20)
+    else:
+        window = int(window)
+        if kind in ('ma', 'sma'):
+            values = _rolling_mean(close, window)
+        elif kind == 'ema':
+            values = pd.DataFrame(close).ewm(span=window, adjust=False, min_periods=window).mean().to_numpy()
+        elif kind == 'rsi':
+            values = _rsi(close, window)
+        elif kind == 'perf':
+            lagged = np.roll(close, window, axis=0)
+            lagged[:window] = np.nan
+            values = (close / lagged - 1) * 100
+        elif kind == 'high':
+            values = pd.DataFrame(bars['high']).rolling(window, min_periods=window).max().to_numpy()
+        else:
+            values = pd.DataFrame(bars['low']).rolling(window, min_periods=window).min().to_numpy()
+    cache[name] = values
+    return values
+
+def _previous(values):
+    shifted = np.roll(values, 1, axis=0)
+    shifted[0] = np.nan
+    return shifted
+
+def evaluate_chunk(conditions, bars, horizons):
+    """Signals and forward returns for one block of symbols (runs in a worker process)
+
+    `bars` maps open/high/low/close/volume to date x symbol arrays that are
+    already compacted per symbol. Returns (rows, cols, forward) where
+    forward is a signals x horizons array of % returns.
+    """
+    cache = {}
+    shape = bars['close'].shape
+    signal = ~np.isnan(bars['close'])
+    with np.errstate(invalid='ignore'):
+        for left, op, right in conditions:
+            a = _series(left, bars, cache) if isinstance(left, str) else np.full(shape, left)
+            b = _series(right, bars, cache) if isinstance(right, str) else np.full(shape, right)
+            if op == '<':
+                signal &= a < b
+            elif op == '<=':
+                signal &= a <= b
+            elif op == '>':
+                signal &= a > b
+            elif op == '>=':
+                signal &= a >= b
+            elif op == 'crosses above':
+                signal &= (a > b) & (_previous(a) <= _previous(b))
+            else:
+                signal &= (a < b) & (_previous(a) >= _previous(b))
+
+        rows, cols = np.nonzero(signal)
+        close = bars['close']
+        forward = np.full((len(rows), len(horizons)), np.nan)
+        for i, h in enumerate(horizons):
+            ahead = rows + h
+            ok = ahead < shape[0]
+            forward[ok, i] = (close[ahead[ok], cols[ok]] / close[rows[ok], cols[ok]] - 1) * 100
+    return rows, cols, forward
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a server process that already runs threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def run_backtest(db, rule, symbols, horizons=DEFAULT_HORIZONS, start=None, scan=False, max_signals=MAX_SIGNALS):
+    """Evaluate a rule over every stored bar of every symbol
+
+    With scan=True only signals on each symbol's latest bar are returned.
+    Raises ValueError for rules that cannot be parsed.
+    """
+    started = time.perf_counter()
+    conditions = parse_rule(rule)
+    horizons = sorted({int(h) for h in horizons if int(h) > 0})
+
+    frames = load_bar_matrices(db, symbols, start, BAR_FIELDS)
+    dates = frames['close'].index
+    symbols = list(frames['close'].columns)
+    close = frames['close'].to_numpy(dtype=float)
+    order = _compact_order(close)
+    bars = {c: np.take_along_axis(frames[c].to_numpy(dtype=float), order, axis=0) for c in BAR_FIELDS}
+    loaded = time.perf_counter()
+
+    # Split into column blocks; each block is self-contained once compacted
+    workers = BACKTEST_WORKERS if len(symbols) >= BACKTEST_PARALLEL_MIN else 1
+    blocks = [b for b in np.array_split(np.arange(len(symbols)), workers) if len(b)]
+    if workers > 1 and len(blocks) > 1:
+        pool = _get_pool()
+        futures = [pool.submit(evaluate_chunk, conditions, {c: v[:, b] for c, v in bars.items()}, horizons) for b in blocks]
+        results = [f.result() for f in futures]
+    else:
+        results = [evaluate_chunk(conditions, {c: v[:, b] for c, v in bars.items()}, horizons) for b in blocks]
+
+    rows = np.concatenate([r[0] for r in results]) if results else np.array([], dtype=int)
+    cols = np.concatenate([b[r[1]] for b, r in zip(blocks, results)]) if results else np.array([], dtype=int)
+    forward = np.concatenate([r[2] for r in results]) if results else np.empty((0, len(horizons)))
+
+    # Back from compacted positions to real dates
+    date_rows = order[rows, cols]
+    if scan:
+        latest = close.shape[0] - 1
+        keep = rows == latest
+        rows, cols, forward, date_rows = rows[keep], cols[keep], forward[keep], date_rows[keep]
+
+    summary = {}
+    for i, h in enumerate(horizons):
+        values = forward[:, i]
+        values = values[~np.isnan(values)]
+        summary[str(h)] = {
+            "count": int(len(values)),
+            "mean_pct": round(float(values.mean()), 2) if len(values) else None,
+            "median_pct": round(float(np.median(values)), 2) if len(values) else None,
+            "hit_rate_pct": round(float((values > 0).mean() * 100), 1) if len(values) else None,
+        }
+
+    # Most recent signals first
+    newest = np.argsort(-date_rows, kind='stable')[:max_signals]
+    signals = [{
+        "symbol": symbols[cols[k]],
+        "date": dates[date_rows[k]].date().isoformat(),
+        "close": round(float(bars['close'][rows[k], cols[k]]), 2),
+        "forward": {str(h): (round(float(forward[k, i]), 2) if not np.isnan(forward[k, i]) else None)
+                    for i, h in enumerate(horizons)},
+    } for k in newest]
+
+    return {
+        "rule": rule,
+        "symbols": len(symbols),
+        "bars": int((~np.isnan(close)).sum()),
+        "signal_count": int(len(rows)),
+        "signals": signals,
+        "summary": summary,
+        "workers": len(blocks) if workers > 1 else 1,
+        "elapsed_ms": {
+            "load": round((loaded - started) * 1000, 1),
+            "evaluate": round((time.perf_counter() - loaded) * 1000, 1),
+        },
+    }
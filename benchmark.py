@@ -0,0 +1,340 @@
+"""Benchmark the API hot paths against the offline replay backend
+
+    python benchmark.py                          # 10, 100 and 1000 symbols
+    python benchmark.py --sizes 10,100 --output bench.json
+    python benchmark.py --compare baseline.json  # exit 1 on regressions
+
+Every size runs in its own process with a fresh SQLite database and
+synthetic replay fixtures, so results do not depend on Yahoo or on state
+left by a previous size. Output is JSON.
+"""
+from datetime import datetime
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HISTORY_BARS = 1300
+TRADES_PER_SYMBOL = 20
+SCREENER_REQUESTS = 50
+SEED = 42
+
+# (path, True when higher is better) of the metrics checked by --compare
+TRACKED = [
+    (('import', 'rows_per_s'), True),
+    (('refresh_cold', 'total_s'), False),
+    (('refresh_warm', 'total_s'), False),
+    (('screener', 'p50_ms'), False),
+    (('screener', 'p95_ms'), False),
+    (('screener', 'requests_per_s'), True),
+    (('screener', 'not_modified_p50_ms'), False),
+    (('memory', 'max_rss_mb'), False),
+]
+
+def symbol_name(i):
+    return f"B{i:04d}"
+
+def write_fixtures(directory, count, bars=HISTORY_BARS):
+    """Synthetic replay data: a seeded random walk, info and a few news items per symbol"""
+    import numpy as np
+    import pandas as pd
+    from providers import ReplayProvider
+
+    replay = ReplayProvider(directory)
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=bars, name='Date')
+    sectors = ['Technology', 'Healthcare', 'Financials', 'Energy', 'Industrials']
+    for i in range(count):
+        symbol = symbol_name(i)
+        if replay.has(symbol):
+            continue
+        rng = np.random.default_rng(SEED + i)
+        close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, bars)))
+        spread = close * rng.uniform(0.002, 0.02, bars)
+        frame = pd.DataFrame({
+            'Open': close + rng.normal(0, 1, bars) * spread / 2,
+            'High': close + spread,
+            'Low': close - spread,
+            'Close': close,
+            'Volume': rng.integers(100_000, 5_000_000, bars).astype(float),
+        }, index=dates)
+        replay.save_history(symbol, frame)
+        replay.save_json(symbol, 'info', {
+            'trailingPE': round(float(rng.uniform(8, 60)), 2),
+            'trailingEps': round(float(rng.uniform(0.5, 12)), 2),
+            'beta': round(float(rng.uniform(0.5, 2)), 2),
+            'marketCap': float(rng.uniform(5e8, 2e12)),
+            'sector': sectors[i % len(sectors)],
+            'fiftyTwoWeekHigh': float(close[-252:].max()),
+            'fiftyTwoWeekLow': float(close[-252:].min()),
+            'dividendYield': round(float(rng.uniform(0, 0.04)), 4),
+            'longBusinessSummary': f"Synthetic company {symbol}",
+        })
+        replay.save_json(symbol, 'news', [
+            {'title': f"{symbol} headline {n}", 'publisher': 'Bench Wire', 'link': 'https://example.com',
+             'providerPublishTime': int(time.time()) - n * 3600}
+            for n in range(3)
+        ])
+
+def watchlist_csv(count, trades_per_symbol):
+    """Import file with one BUY per row, so every symbol gets a transaction history"""
+    import random
+    rng = random.Random(SEED)
+    lines = ['Symbol,Category,Quantity,Avg_Price,Alert_High,Alert_Low,Notes']
+    for i in range(count):
+        symbol = symbol_name(i)
+        category = 'Long Term' if i % 2 else 'Short Term'
+        for n in range(trades_per_symbol):
+            alert = f"{rng.uniform(150, 300):.2f},{rng.uniform(5, 30):.2f}" if n == 0 else ','
+            note = f"note {symbol}" if n == 0 else ''
+            lines.append(f"{symbol},{category},{rng.randint(1, 50)},{rng.uniform(20, 120):.2f},{alert},{note}")
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)]
+
+def _latency(samples):
+    ms = [s * 1000 for s in samples]
+    return {
+        'p50_ms': round(_percentile(ms, 50), 2),
+        'p95_ms': round(_percentile(ms, 95), 2),
+        'p99_ms': round(_percentile(ms, 99), 2),
+        'mean_ms': round(statistics.mean(ms), 2),
+    }
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def _refresh_stages(symbols):
+    """One full screener refresh, timed per stage the way compute_rows runs it"""
+    import screener
+    from market_data import fetch_all, update_indicators
+
+    (infos, _), fetch_s = _timed(fetch_all, symbols)
+    metrics, indicators_s = _timed(update_indicators, symbols)
+    started = time.perf_counter()
+    rows = {}
+    for symbol in symbols:
+        m = metrics.get(symbol)
+        if m and m['bars'] >= 50:
+            rows[symbol] = screener.build_market_row(m, infos.get(symbol, {}))
+    rows_s = time.perf_counter() - started
+    kept = {symbol: metrics[symbol] for symbol in rows}
+    _, publish_s = _timed(screener._publish, rows, kept, symbols, False)
+    return {
+        'fetch_s': round(fetch_s, 3),
+        'indicators_s': round(indicators_s, 3),
+        'rows_s': round(rows_s, 3),
+        'publish_s': round(publish_s, 3),
+        'total_s': round(fetch_s + indicators_s + rows_s + publish_s, 3),
+        'rows': len(rows),
+    }
+
+def run_size(count, requests, trades_per_symbol):
+    """Benchmark one watchlist size; expects the environment prepared by main()
+
+    Memory is the process's peak RSS: tracing allocations (tracemalloc)
+    slows everything else down several times over.
+    """
+    from fastapi.testclient import TestClient
+    from database import init_db, SessionLocal
+    from importer import import_csv
+    from payload import encode
+    from portfolio import load_positions, load_alerts, load_notes
+    import main
+
+    init_db()
+    symbols = [symbol_name(i) for i in range(count)]
+    result = {'symbols': count}
+
+    data = watchlist_csv(count, trades_per_symbol)
+    db = SessionLocal()
+    try:
+        imported, import_s = _timed(import_csv, io.BytesIO(data), db)
+    finally:
+        db.close()
+    result['import'] = {
+        'rows': imported['rows'],
+        'errors': imported['error_count'],
+        'seconds': round(import_s, 3),
+        'rows_per_s': round(imported['rows'] / import_s, 1),
+    }
+
+    result['refresh_cold'] = _refresh_stages(symbols)
+    result['refresh_warm'] = _refresh_stages(symbols)
+    for stage in ('refresh_cold', 'refresh_warm'):
+        # A refresh that left symbols out (e.g. a chunk timed out) measured less work than it claims
+        if result[stage]['rows'] != count:
+            raise SystemExit(f"{stage}: only {result[stage]['rows']} of {count} symbols produced rows")
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        load_positions(db)
+        load_alerts(db)
+        load_notes(db)
+        overlay_db_s = time.perf_counter() - started
+        rows, build_s = _timed(main.build_screener, db)
+    finally:
+        db.close()
+    body, json_s = _timed(encode, rows, 'json')
+    columnar, columnar_s = _timed(encode, rows, 'columnar')
+    result['stages'] = {
+        'db_overlay_s': round(overlay_db_s, 4),
+        'build_screener_s': round(build_s, 4),
+        'serialize_json_s': round(json_s, 4),
+        'serialize_columnar_s': round(columnar_s, 4),
+        'json_bytes': len(body),
+        'columnar_bytes': len(columnar),
+    }
+
+    client = TestClient(main.app)
+    response = client.get('/api/screener')
+    etag = response.headers.get('etag')
+    samples = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        _, elapsed = _timed(client.get, '/api/screener')
+        samples.append(elapsed)
+    wall = time.perf_counter() - started
+    not_modified = [_timed(client.get, '/api/screener', headers={'If-None-Match': etag})[1] for _ in range(requests)]
+    gzipped = client.get('/api/screener', headers={'Accept-Encoding': 'gzip'})
+    result['screener'] = {
+        'requests': requests,
+        **_latency(samples),
+        'requests_per_s': round(requests / wall, 1),
+        'not_modified_p50_ms': round(_percentile(not_modified, 50) * 1000, 2),
+        'response_bytes': len(response.content),
+        'gzip_bytes': int(gzipped.headers.get('content-length', len(gzipped.content))),
+    }
+
+    result['memory'] = {}
+    try:
+        import resource
+        result['memory']['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        pass
+    return result
+
+def _get(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+def compare(current, baseline, tolerance):
+    """Tracked metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    baseline_by_size = {r['symbols']: r for r in baseline.get('results', [])}
+    for result in current['results']:
+        base = baseline_by_size.get(result['symbols'])
+        if base is None:
+            continue
+        for path, higher_is_better in TRACKED:
+            now, before = _get(result, path), _get(base, path)
+            if not now or not before:
+                continue
+            change = (before - now) / before if higher_is_better else (now - before) / before
+            if change > tolerance:
+                regressions.append({
+                    'symbols': result['symbols'],
+                    'metric': '.'.join(path),
+                    'baseline': before,
+                    'current': now,
+                    'change_pct': round(change * 100, 1),
+                })
+    return regressions
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API hot paths on the offline replay backend")
+    parser.add_argument('--sizes', default='10,100,1000', help="comma-separated watchlist sizes")
+    parser.add_argument('--requests', type=int, default=SCREENER_REQUESTS, help="/api/screener requests per size")
+    parser.add_argument('--trades', type=int, default=TRADES_PER_SYMBOL, help="imported transactions per symbol")
+    parser.add_argument('--fixtures', help="replay fixture directory to reuse (default: a temporary one)")
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    parser.add_argument('--compare', help="baseline JSON; exit 1 if a tracked metric regressed")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed regression, as a fraction")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_size(args.child, args.requests, args.trades)))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    with tempfile.TemporaryDirectory(prefix='pulse-bench-') as workdir:
+        fixtures = args.fixtures or os.path.join(workdir, 'replay')
+        print(f"Writing fixtures for {max(sizes)} symbols to {fixtures}", file=sys.stderr)
+        write_fixtures(fixtures, max(sizes))
+
+        results = []
+        for size in sizes:
+            env = {
+                **os.environ,
+                'DATABASE_URL': f"sqlite:///{os.path.join(workdir, f'bench_{size}.db')}",
+                'MARKET_DATA_PROVIDER': 'replay',
+                'REPLAY_DIR': fixtures,
+                'SHARED_DIR': os.path.join(workdir, f'shared_{size}'),
+                'ALERT_WEBHOOK_URL': '',
+            }
+            print(f"Benchmarking {size} symbols...", file=sys.stderr)
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', str(size),
+                 '--requests', str(args.requests), '--trades', str(args.trades)],
+                env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            if child.returncode != 0:
+                print(child.stderr, file=sys.stderr)
+                raise SystemExit(f"Benchmark for {size} symbols failed")
+            results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'sizes': sizes,
+            'requests': args.requests,
+            'trades_per_symbol': args.trades,
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    for r in regressions:
+        print(f"❌ {r['symbols']} symbols: {r['metric']} {r['baseline']} -> {r['current']} ({r['change_pct']}% worse)",
+              file=sys.stderr)
+    if regressions:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
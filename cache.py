@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+# Shared by every cache for stale-while-revalidate refreshes
+_refresh_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-refresh')
+
+class TTLCache:
+    """Bounded LRU cache with a TTL and stale-while-revalidate
+
+    Fresh entries are returned as-is. Entries past their TTL but within
+    `stale_for` are returned immediately while a background refresh runs.
+    Anything older, or missing, is fetched synchronously. Failed fetches are
+    never stored; when one fails, an expired value is returned if there is one.
+
+    With a `store` (shared.SharedStore) every fetched value is written
+    through to it, and entries missing or expired in memory are looked up
+    there first, so workers reuse each other's fetches.
+    """
+
+    def __init__(self, kind: str, ttl: float, stale_for: float, maxsize: int = 1000, store=None):
+        self.kind = kind
+        self.store = store
+        self.ttl = ttl
+        self.stale_for = stale_for
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.fallbacks = 0
+        self.evictions = 0
+
+    def get(self, key, fetch):
+        """Return the cached value for key, calling fetch() when needed"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if self.store is not None and (entry is None or time.monotonic() - entry[1] > self.ttl):
+            # Another worker may have fetched it since
+            entry = self._load_shared(key) or entry
+
+        now = time.monotonic()
+        with self._lock:
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if age <= self.ttl + self.stale_for:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        _refresh_pool.submit(self._refresh, key, fetch)
+                    return value
+            self.misses += 1
+
+        try:
+            value = fetch()
+        except Exception:
+            # Upstream down: an expired value beats none
+            if entry is None:
+                raise
+            with self._lock:
+                self.fallbacks += 1
+            return entry[0]
+        self.set(key, value)
+        return value
+
+    def peek(self, key):
+        """Cached value of any age without fetching, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.store is not None:
+            entry = self._load_shared(key)
+        return entry[0] if entry is not None else None
+
+    def _load_shared(self, key):
+        try:
+            shared = self.store.get(self.kind, key)
+        except Exception as e:
+            print(f"Shared cache read failed: {self.kind} {key}: {e}")
+            return None
+        if shared is None:
+            return None
+        value, updated_at = shared
+        # Wall-clock age from the store, mapped onto this process's monotonic clock
+        entry = (value, time.monotonic() - max(time.time() - updated_at, 0))
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[1] >= entry[1]:
+                return current
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        if self.store is not None:
+            try:
+                self.store.set(self.kind, key, value)
+            except Exception as e:
+                print(f"Shared cache write failed: {self.kind} {key}: {e}")
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.store is not None:
+            self.store.delete(self.kind, key)
+
+    def _refresh(self, key, fetch):
+        try:
+            self.set(key, fetch())
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            with self._lock:
+                self.refresh_errors += 1
+            print(f"Cache refresh failed: {self.kind} {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "fallbacks": self.fallbacks,
+                "evictions": self.evictions
+            }
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one
+
+    The first caller for a key runs fn(); callers arriving while it is in
+    flight wait for it and get the same result or exception. Keys are
+    (kind, ...) tuples and the counters are kept per kind. A waiter gives
+    up with TimeoutError after `timeout` seconds rather than starting a
+    second upstream call.
+    """
+
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = {}
+        self.shared = {}
+
+    def do(self, key, fn):
+        kind = key[0]
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed[kind] = self.executed.get(kind, 0) + 1
+            else:
+                self.shared[kind] = self.shared.get(kind, 0) + 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                raise TimeoutError(f"Waited {self.timeout:.0f}s for in-flight {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            kinds = sorted(set(self.executed) | set(self.shared))
+            in_flight = {}
+            for key in self._calls:
+                in_flight[key[0]] = in_flight.get(key[0], 0) + 1
+            return {kind: {
+                "executed": self.executed.get(kind, 0),
+                "deduplicated": self.shared.get(kind, 0),
+                "in_flight": in_flight.get(kind, 0),
+            } for kind in kinds}
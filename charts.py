@@ -0,0 +1,131 @@
+from datetime import date, timedelta
+from sqlalchemy.orm import Session
+import numpy as np
+import pandas as pd
+
+from market_data import load_bar_matrices
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+RANGES = {'1m': 31, '3m': 92, '6m': 183, '1y': 366, '2y': 731, '5y': 1827}
+RESOLUTIONS = {'1d': None, '1wk': 'W-FRI', '1mo': 'MS'}
+METHODS = ('lttb', 'minmax', 'ohlc')
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+
+def range_start(range_: str, today=None):
+    """First date of a named range: 1m/3m/6m/1y/2y/5y, ytd or max (None)"""
+    today = today or date.today()
+    if range_ == 'max':
+        return None
+    if range_ == 'ytd':
+        return today.replace(month=1, day=1)
+    if range_ not in RANGES:
+        raise ValueError(f"Unknown range: {range_} (use {', '.join(list(RANGES) + ['ytd', 'max'])})")
+    return today - timedelta(days=RANGES[range_])
+
+def load_bars(db: Session, symbol: str, start=None):
+    """Stored OHLCV for one symbol from `start` on, as a date-indexed frame"""
+    matrices = load_bar_matrices(db, [symbol], start, BAR_FIELDS)
+    return pd.DataFrame({c: matrices[c][symbol] for c in BAR_FIELDS}).dropna(subset=['close'])
+
+def resample(bars: pd.DataFrame, resolution: str):
+    """Daily bars aggregated into weekly or monthly candles"""
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution} (use {', '.join(RESOLUTIONS)})")
+    rule = RESOLUTIONS[resolution]
+    if rule is None or bars.empty:
+        return bars
+    return bars.resample(rule).agg({
+        'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'
+    }).dropna(subset=['close'])
+
+def lttb(y, points):
+    """Indices kept by Largest-Triangle-Three-Buckets on evenly spaced samples
+
+    The first and last samples are always kept; every bucket in between
+    contributes the sample forming the largest triangle with the previous
+    pick and the next bucket's average, which keeps the visual shape.
+    """
+    n = len(y)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1])
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    keep = np.empty(points, dtype=int)
+    keep[0] = 0
+    previous = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean() if next_hi > next_lo else x[-1]
+        avg_y = y[next_lo:next_hi].mean() if next_hi > next_lo else y[-1]
+        area = np.abs((x[previous] - avg_x) * (y[lo:hi] - y[previous])
+                      - (x[previous] - x[lo:hi]) * (avg_y - y[previous]))
+        previous = lo + int(np.argmax(area))
+        keep[i + 1] = previous
+    keep[-1] = n - 1
+    return keep
+
+def minmax(y, points):
+    """Indices of each bucket's minimum and maximum (in time order), about `points` in total"""
+    n = len(y)
+    if points >= n:
+        return np.arange(n)
+    buckets = np.array_split(np.arange(n), max(points // 2, 1))
+    keep = []
+    for bucket in buckets:
+        lo, hi = bucket[np.argmin(y[bucket])], bucket[np.argmax(y[bucket])]
+        keep.extend(sorted({lo, hi}))
+    return np.array(keep)
+
+def ohlc_buckets(bars: pd.DataFrame, points):
+    """Consecutive bars merged into at most `points` candles"""
+    n = len(bars)
+    if points >= n:
+        return bars
+    groups = np.repeat(np.arange(points), np.diff(np.linspace(0, n, points + 1).astype(int)))
+    merged = bars.groupby(groups).agg({
+        'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'
+    })
+    merged.index = bars.index[np.r_[0, np.cumsum(np.bincount(groups))[:-1]]]
+    return merged
+
+def chart_history(db: Session, symbol: str, range_='1y', resolution='1d', points=DEFAULT_POINTS, method='lttb'):
+    """Stored history for a chart: range, optional weekly/monthly candles, then at most `points` points
+
+    Raises ValueError for unknown ranges, resolutions or methods.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method} (use {', '.join(METHODS)})")
+    points = max(2, min(int(points), MAX_POINTS))
+    bars = resample(load_bars(db, symbol, range_start(range_)), resolution)
+    source = len(bars)
+
+    if method == 'ohlc':
+        bars = ohlc_buckets(bars, points)
+    elif source > points:
+        close = bars['close'].to_numpy(dtype=float)
+        bars = bars.iloc[lttb(close, points) if method == 'lttb' else minmax(close, points)]
+
+    def values(column, digits):
+        column = np.round(bars[column].to_numpy(dtype=float), digits)
+        cells = column.astype(object)
+        cells[np.isnan(column)] = None
+        return cells.tolist()
+
+    return {
+        "symbol": symbol,
+        "range": range_,
+        "resolution": resolution,
+        "method": method,
+        "source_points": source,
+        "points": len(bars),
+        "dates": [d.date().isoformat() for d in bars.index],
+        "open": values('open', 4),
+        "high": values('high', 4),
+        "low": values('low', 4),
+        "close": values('close', 4),
+        "volume": values('volume', 0),
+    }
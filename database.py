@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine, Column, String, Float, Integer, Text, JSON, DateTime
+from sqlalchemy import create_engine, event, inspect, text, Index, Column, String, Float, Integer, Text, JSON, DateTime, Date
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime
 import os
 
@@ -14,12 +15,24 @@ class Ticker(Base):
     category = Column(String(50), nullable=False)
 
 class Portfolio(Base):
+    """Position ledger, kept up to date on every transaction write
+
+    quantity/cost_basis/avg_price follow the screener's net-cost convention
+    (sale proceeds reduce cost); realized_pnl uses average cost, tracked
+    separately in book_cost.
+    """
     __tablename__ = 'portfolio'
     
     id = Column(Integer, primary_key=True)
     symbol = Column(String(10), unique=True, nullable=False)
     quantity = Column(Float, default=0)
     avg_price = Column(Float, default=0)
+    cost_basis = Column(Float, default=0)
+    book_cost = Column(Float, default=0)
+    realized_pnl = Column(Float, default=0)
+    trade_count = Column(Integer, default=0)
+    last_trade_date = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Transaction(Base):
     """Transaction history for portfolio tracking"""
@@ -32,6 +45,33 @@ class Transaction(Base):
     price = Column(Float, nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
     notes = Column(Text, default='')
+    
+    __table_args__ = (
+        Index('ix_transactions_symbol_type_date', 'symbol', 'transaction_type', 'date'),
+        Index('ix_transactions_symbol_date', 'symbol', 'date'),
+    )
+
+class PriceBar(Base):
+    """Daily OHLCV bar stored locally so refreshes only fetch new bars"""
+    __tablename__ = 'price_bars'
+    
+    symbol = Column(String(10), primary_key=True)
+    date = Column(Date, primary_key=True)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float, nullable=False)
+    volume = Column(Float, default=0)
+
+class IndicatorState(Base):
+    """Running indicator state per symbol so new bars update metrics incrementally"""
+    __tablename__ = 'indicator_state'
+    
+    symbol = Column(String(10), primary_key=True)
+    first_date = Column(Date)
+    last_date = Column(Date)
+    state = Column(JSON)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Alert(Base):
     __tablename__ = 'alerts'
@@ -41,6 +81,31 @@ class Alert(Base):
     high = Column(Float, nullable=True)
     low = Column(Float, nullable=True)
 
+class AlertRule(Base):
+    """Indicator-based alert condition, e.g. RSI crossing below 30 or MA50 crossing above MA250"""
+    __tablename__ = 'alert_rules'
+
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String(10), nullable=False, index=True)
+    kind = Column(String(20), nullable=False)  # 'rsi_above', 'rsi_below', 'ma_cross_above', 'ma_cross_below'
+    value = Column(Float, nullable=True)  # RSI level; unused for MA crossovers
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AlertEvent(Base):
+    """One alert firing, recorded by the alert engine"""
+    __tablename__ = 'alert_events'
+
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String(10), nullable=False)
+    kind = Column(String(20), nullable=False)  # 'high', 'low' or an AlertRule kind
+    threshold = Column(Float, nullable=True)
+    value = Column(Float, nullable=True)
+    triggered_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index('ix_alert_events_symbol_triggered', 'symbol', 'triggered_at'),
+    )
+
 class Note(Base):
     __tablename__ = 'notes'
     
@@ -62,12 +127,94 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./watchlist.db')
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith('sqlite')
+
+if IS_SQLITE:
+    # Sessions are used from FastAPI's threadpool and the refresh workers
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={'check_same_thread': False, 'timeout': 30}
+    )
+
+    @event.listens_for(engine, 'connect')
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if ':memory:' not in DATABASE_URL:
+            # WAL lets readers proceed while a refresh is writing bars
+            cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute(f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_KB', '65536'))}")
+        cursor.close()
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=int(os.getenv('DB_POOL_SIZE', '10')),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', '30')),
+        pool_pre_ping=True
+    )
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def upsert(db, model, rows, index_elements, update_columns=()):
+    """Insert rows in one statement, updating update_columns (or skipping the row) on conflict"""
+    if not rows:
+        return
+    dialect = engine.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        for row in rows:
+            key = {k: row[k] for k in index_elements}
+            existing = db.query(model).filter_by(**key).first()
+            if existing is None:
+                db.add(model(**row))
+            else:
+                for column in update_columns:
+                    setattr(existing, column, row[column])
+        return
+
+    # Core statement on the session's connection: a plain executemany, no ORM bookkeeping
+    stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(model.__table__)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    db.connection().execute(stmt, rows)
+
+def add_missing_columns():
+    """Add columns introduced after a table was first created (create_all skips existing tables)"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+def add_missing_indexes():
+    """Create indexes declared on models that an existing database does not have yet"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                print(f"✅ Created index {index.name}")
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
     
     # Add default settings
     db = SessionLocal()
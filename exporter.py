@@ -0,0 +1,157 @@
+from datetime import date
+import csv
+import io
+import zlib
+
+from database import SessionLocal, Ticker, Portfolio, Alert, Note, Transaction, PriceBar
+from portfolio import _position
+
+# Rows fetched per round trip and per yielded chunk / Parquet row group
+EXPORT_BATCH = 5000
+
+# Column name and Parquet type for each dataset (CSV writes None as an empty field)
+WATCHLIST_COLUMNS = [('Symbol', 'string'), ('Category', 'string'), ('Quantity', 'float64'),
+                     ('Avg_Price', 'float64'), ('Alert_High', 'float64'), ('Alert_Low', 'float64'),
+                     ('Notes', 'string')]
+TRANSACTION_COLUMNS = [('id', 'int64'), ('symbol', 'string'), ('transaction_type', 'string'),
+                       ('quantity', 'float64'), ('price', 'float64'), ('date', 'timestamp'),
+                       ('notes', 'string')]
+PRICE_COLUMNS = [('symbol', 'string'), ('date', 'date'), ('open', 'float64'), ('high', 'float64'),
+                 ('low', 'float64'), ('close', 'float64'), ('volume', 'float64')]
+
+DATASETS = ('watchlist', 'transactions', 'prices')
+FORMATS = ('csv', 'parquet')
+
+def _watchlist_rows(db):
+    query = db.query(
+        Ticker.symbol, Ticker.category, Portfolio.quantity, Portfolio.cost_basis,
+        Alert.high, Alert.low, Note.content
+    ).outerjoin(Portfolio, Portfolio.symbol == Ticker.symbol) \
+     .outerjoin(Alert, Alert.symbol == Ticker.symbol) \
+     .outerjoin(Note, Note.symbol == Ticker.symbol) \
+     .order_by(Ticker.id)
+    for symbol, category, quantity, cost, high, low, content in query.yield_per(EXPORT_BATCH):
+        pos_data = _position(quantity, cost)
+        yield (symbol, category, pos_data['quantity'], pos_data['avg_price'], high, low, content)
+
+def _transaction_rows(db):
+    query = db.query(*[getattr(Transaction, c) for c, _ in TRANSACTION_COLUMNS]) \
+        .order_by(Transaction.symbol, Transaction.date, Transaction.id)
+    return (tuple(row) for row in query.yield_per(EXPORT_BATCH))
+
+def _price_rows(db):
+    query = db.query(*[getattr(PriceBar, c) for c, _ in PRICE_COLUMNS]) \
+        .order_by(PriceBar.symbol, PriceBar.date)
+    return (tuple(row) for row in query.yield_per(EXPORT_BATCH))
+
+_SOURCES = {
+    'watchlist': (WATCHLIST_COLUMNS, _watchlist_rows),
+    'transactions': (TRANSACTION_COLUMNS, _transaction_rows),
+    'prices': (PRICE_COLUMNS, _price_rows),
+}
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for batch in _batches(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _parquet_chunks(columns, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'string': pa.string(), 'float64': pa.float64(), 'int64': pa.int64(), 'timestamp': pa.timestamp('us'),
+             'date': pa.date32()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    # One row group per batch, handed to the client as soon as it is written
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    yield sink.drain()
+    for batch in _batches(rows):
+        arrays = [pa.array(column, type=field.type) for column, field in zip(zip(*batch), schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def export_stream(dataset='watchlist', fmt='csv', gzip=False):
+    """Generator of export bytes, read from the database in batches with its own session"""
+    columns, source = _SOURCES[dataset]
+
+    def chunks():
+        db = SessionLocal()
+        try:
+            rows = source(db)
+            if fmt == 'parquet':
+                yield from _parquet_chunks(columns, rows)
+            else:
+                yield from _csv_chunks(columns, rows)
+        finally:
+            db.close()
+
+    return _gzip(chunks()) if gzip else chunks()
+
+def export_filename(dataset, fmt, gzip):
+    name = f"pulse_{dataset}_{date.today().isoformat()}.{fmt}"
+    return name + '.gz' if gzip else name
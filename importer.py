@@ -0,0 +1,108 @@
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from datetime import datetime
+import csv
+import io
+import os
+
+from database import Ticker, Alert, Note, Transaction, upsert
+from portfolio import apply_transactions
+
+# Rows written per batch; the upload itself is read incrementally
+IMPORT_BATCH = int(os.getenv('IMPORT_BATCH', '5000'))
+# Row errors returned in the response (all of them are counted)
+MAX_REPORTED_ERRORS = 100
+
+class _Batch:
+    def __init__(self):
+        self.tickers = {}
+        self.transactions = []
+        self.alerts = {}
+        self.notes = {}
+
+    def __len__(self):
+        return len(self.tickers) + len(self.transactions) + len(self.alerts) + len(self.notes)
+
+def _float(row, column):
+    value = row.get(column)
+    return float(value) if value else None
+
+def import_csv(stream, db: Session):
+    """Import a watchlist CSV from a binary stream
+
+    Existing symbols, alerts and notes are loaded once; rows are parsed as
+    the stream is read and written in batches with bulk inserts/upserts.
+    Returns the number of new tickers, rows read, and per-row errors.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+
+    known_symbols = {symbol for (symbol,) in db.query(Ticker.symbol)}
+    alerts = {symbol: (high, low) for symbol, high, low in db.query(Alert.symbol, Alert.high, Alert.low)}
+
+    imported = 0
+    rows_read = 0
+    errors = []
+    error_count = 0
+    now = datetime.now()
+    batch = _Batch()
+
+    for row in reader:
+        rows_read += 1
+        try:
+            symbol = row['Symbol'].upper().strip()
+            if not symbol:
+                raise ValueError("Empty symbol")
+            category = row.get('Category', 'Short Term')
+
+            # Parse everything before touching the batch so a bad row changes nothing
+            transaction = None
+            if row.get('Quantity') and row.get('Avg_Price'):
+                qty = float(row['Quantity'])
+                price = float(row['Avg_Price'])
+                if qty > 0:
+                    transaction = {'symbol': symbol, 'transaction_type': 'BUY', 'quantity': qty,
+                                   'price': price, 'date': now, 'notes': ''}
+
+            alert = None
+            if row.get('Alert_High') or row.get('Alert_Low'):
+                high, low = _float(row, 'Alert_High'), _float(row, 'Alert_Low')
+                if symbol in alerts:
+                    # Only the thresholds present in the row replace the stored ones
+                    old_high, old_low = alerts[symbol]
+                    alert = (high if high is not None else old_high, low if low is not None else old_low)
+                else:
+                    alert = (high, low)
+
+            if symbol not in known_symbols:
+                known_symbols.add(symbol)
+                batch.tickers[symbol] = {'symbol': symbol, 'category': category}
+                imported += 1
+            if transaction:
+                batch.transactions.append(transaction)
+            if alert:
+                alerts[symbol] = alert
+                batch.alerts[symbol] = {'symbol': symbol, 'high': alert[0], 'low': alert[1]}
+            if row.get('Notes'):
+                batch.notes[symbol] = {'symbol': symbol, 'content': row['Notes']}
+        except Exception as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                # Line 1 is the header
+                errors.append({"line": reader.line_num, "error": str(e) or type(e).__name__})
+            continue
+
+        if len(batch) >= IMPORT_BATCH:
+            _write(batch, db)
+            batch = _Batch()
+
+    _write(batch, db)
+    db.commit()
+    return {"count": imported, "rows": rows_read, "error_count": error_count, "errors": errors}
+
+def _write(batch: _Batch, db: Session):
+    upsert(db, Ticker, list(batch.tickers.values()), ['symbol'])
+    if batch.transactions:
+        db.connection().execute(insert(Transaction.__table__), batch.transactions)
+        apply_transactions(db, batch.transactions)
+    upsert(db, Alert, list(batch.alerts.values()), ['symbol'], ['high', 'low'])
+    upsert(db, Note, list(batch.notes.values()), ['symbol'], ['content'])
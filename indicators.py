@@ -0,0 +1,266 @@
+import warnings
+import numpy as np
+import pandas as pd
+from collections import deque
+from datetime import date
+
+# Performance horizons in trading days; '3y' falls back to the full history when shorter
+PERF_WINDOWS = {'1d': 1, '1m': 21, '3m': 63, '6m': 126, '1y': 252, '3y': 756}
+MA_WINDOWS = (50, 100, 250)
+RSI_WINDOW = 14
+VOLUME_WINDOW = 20
+TRADING_DAYS = 252
+
+def price_matrix(histories, column='Close'):
+    """Align one column of every symbol's history into a date x symbol matrix"""
+    if not histories:
+        return pd.DataFrame()
+    return pd.concat({symbol: hist[column] for symbol, hist in histories.items()}, axis=1).sort_index()
+
+def _compact(values, valid):
+    """Move each column's valid values to the bottom, keeping their order
+
+    Symbols trade on different calendars, so after date alignment row -k is
+    not necessarily a symbol's k-th latest bar. Compacting restores that, so
+    every window below matches what a per-symbol series would give.
+    """
+    order = np.argsort(valid, axis=0, kind='stable')
+    return np.take_along_axis(values, order, axis=0)
+
+def _lagged(values, lags):
+    """Value `lags` bars before the last row, per column (NaN when out of range)"""
+    rows = values.shape[0]
+    idx = rows - 1 - lags
+    in_range = idx >= 0
+    picked = values[np.clip(idx, 0, rows - 1), np.arange(values.shape[1])]
+    return np.where(in_range, picked, np.nan)
+
+def _pct_change(end, start, available):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.round((end - start) / start * 100, 2)
+    ok = available & (start != 0) & ~np.isnan(start)
+    return np.where(ok, pct, 0.0)
+
+def _tail_mean(values, window):
+    if values.shape[0] < window:
+        return np.full(values.shape[1], np.nan)
+    return values[-window:].mean(axis=0)
+
+def compute_indicators(closes: pd.DataFrame, volumes: pd.DataFrame):
+    """Compute every screener indicator for every symbol in one vectorized pass
+
+    Takes date x symbol close and volume matrices and returns one row per
+    symbol with price, perf_*, ma_*, rsi, avg_volume, volatility and the
+    number of bars the symbol has.
+    """
+    symbols = list(closes.columns)
+    if closes.empty:
+        return pd.DataFrame(index=pd.Index([], name='symbol'))
+
+    volumes = volumes.reindex(index=closes.index, columns=symbols)
+    close_raw = closes.to_numpy(dtype=float)
+    valid = ~np.isnan(close_raw)
+    c = _compact(close_raw, valid)
+    v = _compact(np.where(valid, volumes.to_numpy(dtype=float), np.nan), valid)
+    bars = valid.sum(axis=0)
+
+    price = c[-1]
+    out = {
+        'bars': bars,
+        'price': price,
+        'yesterday': np.where(bars > 1, _lagged(c, np.ones_like(bars)), price),
+    }
+
+    for name, days in PERF_WINDOWS.items():
+        lags = np.full_like(bars, days)
+        if name == '3y':
+            lags = np.where(bars >= days, days, bars - 1)
+        out[f'perf_{name}'] = _pct_change(price, _lagged(c, lags), bars >= lags + 1)
+
+    for window in MA_WINDOWS:
+        out[f'ma_{window}'] = _tail_mean(c, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.diff(c, axis=0)
+        gain = _tail_mean(np.where(delta > 0, delta, 0.0), RSI_WINDOW)
+        loss = _tail_mean(np.where(delta < 0, -delta, 0.0), RSI_WINDOW)
+        rsi = 100 - (100 / (1 + gain / loss))
+    out['rsi'] = np.where(bars >= RSI_WINDOW, rsi, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        # All-NaN columns ("Mean of empty slice") just come out as NaN
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        out['avg_volume'] = np.nanmean(v[-VOLUME_WINDOW:], axis=0)
+        returns = c[1:] / c[:-1] - 1
+        out['volatility'] = np.nanstd(returns, axis=0, ddof=1) * np.sqrt(TRADING_DAYS) * 100
+
+    return pd.DataFrame(out, index=pd.Index(symbols, name='symbol'))
+
+class RunningIndicators:
+    """Per-symbol running indicator state, updated in O(1) per bar
+
+    Holds just enough of the recent tail (the longest perf lag, the volume
+    and RSI windows) plus running sums for the moving averages and the
+    return variance. Produces the same row as compute_indicators.
+    """
+    CLOSE_TAIL = max(PERF_WINDOWS.values()) + 1
+
+    def __init__(self):
+        self.closes = deque(maxlen=self.CLOSE_TAIL)
+        self.volumes = deque(maxlen=VOLUME_WINDOW)
+        self.gains = deque(maxlen=RSI_WINDOW)
+        self.losses = deque(maxlen=RSI_WINDOW)
+        self.ma_sums = {w: 0.0 for w in MA_WINDOWS}
+        self.ret_n = 0
+        self.ret_sum = 0.0
+        self.ret_sumsq = 0.0
+        self.bars = 0
+        self.first_date = None
+        self.first_close = None
+        self.last_date = None
+
+    @classmethod
+    def from_history(cls, hist: pd.DataFrame):
+        """Full rebuild from a symbol's stored OHLCV history"""
+        state = cls()
+        hist = hist.dropna(subset=['Close'])
+        if hist.empty:
+            return state
+        close = hist['Close'].to_numpy(dtype=float)
+        volume = hist['Volume'].to_numpy(dtype=float)
+
+        state.bars = len(close)
+        state.first_date = hist.index[0].date()
+        state.first_close = float(close[0])
+        state.last_date = hist.index[-1].date()
+        state.closes.extend(close[-cls.CLOSE_TAIL:].tolist())
+        state.volumes.extend(volume[-VOLUME_WINDOW:].tolist())
+        delta = np.diff(close[-(RSI_WINDOW + 1):])
+        state.gains.extend(np.where(delta > 0, delta, 0.0).tolist())
+        state.losses.extend(np.where(delta < 0, -delta, 0.0).tolist())
+        for w in MA_WINDOWS:
+            state.ma_sums[w] = float(close[-w:].sum())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = close[1:] / close[:-1] - 1
+        returns = returns[np.isfinite(returns)]
+        state.ret_n = len(returns)
+        state.ret_sum = float(returns.sum())
+        state.ret_sumsq = float((returns ** 2).sum())
+        return state
+
+    def push(self, day, close: float, volume: float):
+        """Append a new bar"""
+        if not self.closes:
+            self.first_date, self.first_close = day, close
+        else:
+            prev = self.closes[-1]
+            self._add_return(close / prev - 1 if prev else np.nan, 1)
+            self.gains.append(max(close - prev, 0.0))
+            self.losses.append(max(prev - close, 0.0))
+        n = len(self.closes)
+        for w in MA_WINDOWS:
+            self.ma_sums[w] += close - (self.closes[n - w] if n >= w else 0.0)
+        self.closes.append(close)
+        self.volumes.append(volume)
+        self.bars += 1
+        self.last_date = day
+
+    def update_last(self, close: float, volume: float):
+        """Replace the latest bar, e.g. when an intraday bar moves"""
+        old = self.closes[-1]
+        if len(self.closes) > 1:
+            prev = self.closes[-2]
+            self._add_return(old / prev - 1 if prev else np.nan, -1)
+            self._add_return(close / prev - 1 if prev else np.nan, 1)
+            self.gains[-1] = max(close - prev, 0.0)
+            self.losses[-1] = max(prev - close, 0.0)
+        for w in MA_WINDOWS:
+            self.ma_sums[w] += close - old
+        self.closes[-1] = close
+        self.volumes[-1] = volume
+        if self.bars == 1:
+            self.first_close = close
+
+    def drop_first(self, next_date, next_close: float):
+        """Drop the oldest bar once it leaves the history window"""
+        first = self.first_close
+        self._add_return(next_close / first - 1 if first else np.nan, -1)
+        self.bars -= 1
+        self.first_date, self.first_close = next_date, next_close
+
+    def _add_return(self, r, sign):
+        if not np.isfinite(r):
+            return
+        self.ret_n += sign
+        self.ret_sum += sign * r
+        self.ret_sumsq += sign * r * r
+
+    def metrics(self):
+        """Current indicator row, keyed like compute_indicators"""
+        closes = self.closes
+        price = closes[-1]
+        out = {
+            'bars': self.bars,
+            'price': price,
+            'yesterday': closes[-2] if self.bars > 1 else price,
+        }
+
+        for name, days in PERF_WINDOWS.items():
+            lag = days
+            if name == '3y' and self.bars < days:
+                lag = self.bars - 1
+            start = closes[-(lag + 1)] if self.bars >= lag + 1 else np.nan
+            end_ok = self.bars >= lag + 1 and start != 0 and not np.isnan(start)
+            out[f'perf_{name}'] = float(np.round((price - start) / start * 100, 2)) if end_ok else 0.0
+
+        for w in MA_WINDOWS:
+            out[f'ma_{w}'] = self.ma_sums[w] / w if self.bars >= w else np.nan
+
+        rsi = np.nan
+        if self.bars >= RSI_WINDOW and len(self.gains) == RSI_WINDOW:
+            gain = sum(self.gains) / RSI_WINDOW
+            loss = sum(self.losses) / RSI_WINDOW
+            if loss > 0:
+                rsi = 100 - (100 / (1 + gain / loss))
+            elif gain > 0:
+                rsi = 100.0
+        out['rsi'] = rsi
+
+        valid_volumes = [v for v in self.volumes if not np.isnan(v)]
+        out['avg_volume'] = sum(valid_volumes) / len(valid_volumes) if valid_volumes else np.nan
+
+        volatility = np.nan
+        if self.ret_n > 1:
+            var = (self.ret_sumsq - self.ret_sum ** 2 / self.ret_n) / (self.ret_n - 1)
+            volatility = np.sqrt(max(var, 0.0)) * np.sqrt(TRADING_DAYS) * 100
+        out['volatility'] = volatility
+        return out
+
+    def to_dict(self):
+        return {
+            'closes': list(self.closes),
+            'volumes': [None if np.isnan(v) else v for v in self.volumes],
+            'gains': list(self.gains),
+            'losses': list(self.losses),
+            'ma_sums': {str(w): s for w, s in self.ma_sums.items()},
+            'ret': [self.ret_n, self.ret_sum, self.ret_sumsq],
+            'bars': self.bars,
+            'first_date': self.first_date.isoformat() if self.first_date else None,
+            'first_close': self.first_close,
+            'last_date': self.last_date.isoformat() if self.last_date else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.closes.extend(data['closes'])
+        state.volumes.extend(v if v is not None else np.nan for v in data['volumes'])
+        state.gains.extend(data['gains'])
+        state.losses.extend(data['losses'])
+        state.ma_sums = {int(w): s for w, s in data['ma_sums'].items()}
+        state.ret_n, state.ret_sum, state.ret_sumsq = data['ret']
+        state.bars = data['bars']
+        state.first_date = date.fromisoformat(data['first_date']) if data['first_date'] else None
+        state.first_close = data['first_close']
+        state.last_date = date.fromisoformat(data['last_date']) if data['last_date'] else None
+        return state
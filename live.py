@@ -0,0 +1,100 @@
+from fastapi.encoders import jsonable_encoder
+import asyncio
+import json
+
+# Messages a slow client may fall behind by before it is dropped (it reconnects and resyncs)
+STREAM_QUEUE_SIZE = 100
+
+def diff_rows(old, new):
+    """Per-symbol changes between two {symbol: row} mappings, at top-level field granularity"""
+    changed = []
+    for symbol, row in new.items():
+        before = old.get(symbol)
+        if before is None:
+            changed.append(row)
+            continue
+        fields = {k: v for k, v in row.items() if before.get(k) != v}
+        if fields:
+            changed.append({"symbol": symbol, **fields})
+    removed = [symbol for symbol in old if symbol not in new]
+    return changed, removed
+
+class Broadcaster:
+    """Pushes screener changes to every connected stream
+
+    The screener payload is rebuilt once per change, not once per client,
+    and only while someone is listening. Clients get one full snapshot when
+    they subscribe and per-symbol deltas afterwards.
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._rows = {}
+        self._current = False
+        self._subscribers = set()
+        self._loop = None
+        self._dirty = None
+
+    def start(self, loop):
+        self._loop = loop
+        self._dirty = asyncio.Event()
+        return loop.create_task(self._run())
+
+    def notify(self):
+        """Mark the payload as changed; safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._dirty.set)
+
+    def publish(self, event, data):
+        """Send a one-off event (e.g. an alert) to every client; safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._send, (event, data))
+
+    async def subscribe(self):
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        if not self._current:
+            await self._rebuild()
+        self._subscribers.add(queue)
+        queue.put_nowait(("snapshot", {"rows": list(self._rows.values())}))
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    async def _rebuild(self):
+        rows = await asyncio.to_thread(self._build)
+        new = {row["symbol"]: row for row in jsonable_encoder(rows)}
+        changed, removed = diff_rows(self._rows, new)
+        self._rows = new
+        self._current = True
+        return changed, removed
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            if not self._subscribers:
+                self._current = False
+                continue
+            try:
+                changed, removed = await self._rebuild()
+            except Exception as e:
+                print(f"Stream rebuild failed: {e}")
+                continue
+            if not changed and not removed:
+                continue
+            self._send(("delta", {"changed": changed, "removed": removed}))
+
+    def _send(self, message):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too far behind: end its stream so it reconnects and resyncs
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -1,17 +1,32 @@
-import yfinance as yf
-from fastapi import FastAPI, UploadFile, File, Depends
+from fastapi import FastAPI, UploadFile, File, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from starlette.middleware.gzip import GZipMiddleware, DEFAULT_EXCLUDED_CONTENT_TYPES
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from sqlalchemy.orm import Session
-import pandas as pd
-import numpy as np
-from datetime import datetime
-import io
-import csv
+from datetime import datetime, timezone
+import asyncio
+import os
 
-from database import init_db, get_db, Ticker, Portfolio, Alert, Note, Settings, Transaction
+from database import init_db, get_db, engine, SessionLocal, Ticker, Portfolio, Alert, AlertRule, Note, Settings, Transaction, PriceBar
+from market_data import fetch_info, fetch_news, cache_stats, upstream_stats, provider_status
+from screener import ensure_snapshot, current_snapshot, load_shared_snapshot, run_scheduler, on_publish
+from shared import leadership, exclusive, watch, changed
+from live import Broadcaster, format_event
+from importer import import_csv
+from analytics import portfolio_analytics
+from backtest import run_backtest
+from charts import chart_history, DEFAULT_POINTS
+from alerts import evaluate_alerts, relay_events, invalidate_alerts, on_alert, recent_events, RULE_KINDS
+from query import query_rows
+from payload import encode, etag_response, msgpack_available, MEDIA_TYPES, FORMATS as PAYLOAD_FORMATS
+from exporter import export_stream, export_filename, parquet_available, DATASETS, FORMATS
+from metrics import MetricsMiddleware, instrument_engine, render as render_metrics, timed
+from portfolio import load_positions, load_alerts, load_notes, apply_transaction, rebuild_symbol, ensure_ledger, EMPTY_POSITION
+
+# Seconds between keepalive comments on idle event streams
+STREAM_KEEPALIVE = 15
 
 app = FastAPI(title="Pulse 4.0 Institutional Terminal")
 
@@ -21,12 +36,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "ETag", "Server-Timing"],
+)
+# Already compressed downloads are passed through as is
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=1000,
+    compresslevel=6,
+    exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES + ("application/gzip", "application/vnd.apache.parquet"),
 )
+# Outermost, so request timings include compression; send X-Timing: 1 for a Server-Timing header
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
 
 @app.on_event("startup")
 async def startup_event():
-    init_db()
-    print("✅ Database initialized")
+    # Workers start together; one migrates while the others wait
+    with exclusive('startup'):
+        init_db()
+        print("✅ Database initialized")
+        db = SessionLocal()
+        try:
+            if ensure_ledger(db):
+                print("✅ Position ledger rebuilt from transactions")
+        finally:
+            db.close()
+    # Serve the last shared snapshot until this worker or the leader has a newer one
+    if await asyncio.to_thread(load_shared_snapshot):
+        print(f"✅ Loaded shared snapshot v{current_snapshot().version}")
+    app.state.scheduler = asyncio.create_task(run_scheduler())
+    app.state.broadcaster = broadcaster.start(asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.scheduler.cancel()
+    app.state.broadcaster.cancel()
 
 @app.get("/")
 async def read_root():
@@ -52,51 +96,25 @@ class AlertModel(BaseModel):
     high: Optional[float] = None
     low: Optional[float] = None
 
+class AlertRuleModel(BaseModel):
+    kind: str
+    value: Optional[float] = None
+
+class BacktestModel(BaseModel):
+    rule: str
+    symbols: Optional[List[str]] = None
+    horizons: List[int] = [5, 20, 60]
+    start: Optional[str] = None
+    scan: bool = False
+    max_signals: int = Field(1000, ge=0)
+
 class NoteModel(BaseModel):
     notes: str
 
-def get_pct_change(series, days):
-    if len(series) < days + 1:
-        return 0
-    try:
-        start_val = series.iloc[-(days+1)]
-        end_val = series.iloc[-1]
-        if start_val == 0 or pd.isna(start_val): 
-            return 0
-        return round(((end_val - start_val) / start_val) * 100, 2)
-    except:
-        return 0
-
-def format_earnings_date(earnings_date):
-    try:
-        if isinstance(earnings_date, (int, float)):
-            dt = datetime.fromtimestamp(earnings_date)
-        elif isinstance(earnings_date, str):
-            dt = datetime.fromisoformat(earnings_date.replace('Z', '+00:00'))
-        else:
-            dt = earnings_date
-        
-        now = datetime.now()
-        if dt.date() < now.date():
-            return f"{dt.strftime('%b %d, %Y')} (Past)"
-        elif dt.date() == now.date():
-            return "Today"
-        else:
-            days_until = (dt.date() - now.date()).days
-            if days_until == 1:
-                return "Tomorrow"
-            elif days_until <= 7:
-                return f"In {days_until} days ({dt.strftime('%b %d')})"
-            else:
-                return dt.strftime('%b %d, %Y')
-    except:
-        return None
-
 def fetch_news_enhanced(symbol):
     news_items = []
     try:
-        t = yf.Ticker(symbol)
-        news_data = t.news
+        news_data = fetch_news(symbol)
         if news_data and len(news_data) > 0:
             for n in news_data[:8]:
                 try:
@@ -134,8 +152,9 @@ def fetch_news_enhanced(symbol):
                     })
                 except Exception as e:
                     continue
-    except:
-        pass
+    except Exception as e:
+        # Upstream down and nothing cached: fall through to the search links
+        print(f"News unavailable for {symbol}: {e}")
     
     if not news_items:
         news_items = [
@@ -144,70 +163,30 @@ def fetch_news_enhanced(symbol):
         ]
     return news_items
 
-def calculate_portfolio_from_transactions(symbol: str, db: Session):
-    """Calculate portfolio stats from transaction history"""
-    buys = db.query(Transaction).filter_by(symbol=symbol, transaction_type='BUY').all()
-    sells = db.query(Transaction).filter_by(symbol=symbol, transaction_type='SELL').all()
-    
-    total_bought = sum(t.quantity for t in buys)
-    total_sold = sum(t.quantity for t in sells)
-    current_qty = total_bought - total_sold
-    
-    if current_qty <= 0:
-        return {'quantity': 0, 'avg_price': 0}
-    
-    # Calculate weighted average
-    cost = sum(t.quantity * t.price for t in buys) - sum(t.quantity * t.price for t in sells)
-    avg_price = cost / current_qty if current_qty > 0 else 0
-    
-    return {'quantity': round(current_qty, 4), 'avg_price': round(avg_price, 2)}
-
-@app.get("/api/screener")
-def get_screener(db: Session = Depends(get_db)):
+def build_screener(db: Session, category: Optional[str] = None):
+    """Latest snapshot overlaid with the user's positions, alerts and notes"""
     results = []
-    tickers = db.query(Ticker).all()
+    query = db.query(Ticker)
+    if category and category != "All":
+        query = query.filter(Ticker.category == category)
+    tickers = query.all()
+    snapshot = ensure_snapshot([ticker.symbol for ticker in tickers])
+    positions = load_positions(db)
+    alerts = load_alerts(db)
+    notes = load_notes(db)
     
     for ticker in tickers:
         try:
             symbol = ticker.symbol
             category = ticker.category
             
-            t = yf.Ticker(symbol)
-            hist = t.history(period="5y")
-            
-            if hist.empty or len(hist) < 50:
+            row = snapshot.rows.get(symbol)
+            if not row:
                 continue
-                
-            close = hist['Close']
-            volume = hist['Volume']
-            current_price = close.iloc[-1]
-            
-            info = {}
-            try:
-                info = t.info or {}
-            except:
-                pass
-            
-            ma50 = close.rolling(50).mean().iloc[-1]
-            ma100 = close.rolling(100).mean().iloc[-1]
-            ma250 = close.rolling(250).mean().iloc[-1]
-            
-            try:
-                delta = close.diff()
-                gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-                loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-                rs = gain / loss
-                rsi = 100 - (100 / (1 + rs.iloc[-1]))
-                rsi = round(rsi, 2) if not np.isnan(rsi) else '—'
-            except:
-                rsi = '—'
-            
-            avg_volume = volume.tail(20).mean() if len(volume) >= 20 else volume.mean()
-            returns = close.pct_change().dropna()
-            volatility = returns.std() * np.sqrt(252) * 100
+            current_price = snapshot.metrics[symbol]['price']
             
             # Calculate from transactions
-            pos_data = calculate_portfolio_from_transactions(symbol, db)
+            pos_data = positions.get(symbol, EMPTY_POSITION)
             quantity = pos_data['quantity']
             avg_price = pos_data['avg_price']
             
@@ -216,7 +195,7 @@ def get_screener(db: Session = Depends(get_db)):
             pnl = total_value - cost_basis if quantity > 0 else 0
             pnl_pct = round((pnl / cost_basis) * 100, 2) if cost_basis > 0 else 0
             
-            alert = db.query(Alert).filter_by(symbol=symbol).first()
+            alert = alerts.get(symbol)
             alert_data = {}
             alert_triggered = False
             if alert:
@@ -229,64 +208,12 @@ def get_screener(db: Session = Depends(get_db)):
                     if current_price <= alert.low:
                         alert_triggered = True
             
-            earnings_date_display = None
-            try:
-                if 'earningsDate' in info and info['earningsDate']:
-                    earnings_date = info['earningsDate']
-                    if isinstance(earnings_date, list) and len(earnings_date) > 0:
-                        earnings_date_display = format_earnings_date(earnings_date[0])
-            except:
-                pass
-            
-            market_cap = info.get('marketCap', 0)
-            if market_cap >= 1e12:
-                market_cap_display = f"${market_cap/1e12:.2f}T"
-            elif market_cap >= 1e9:
-                market_cap_display = f"${market_cap/1e9:.2f}B"
-            elif market_cap >= 1e6:
-                market_cap_display = f"${market_cap/1e6:.2f}M"
-            else:
-                market_cap_display = "—"
-            
-            dividend_yield = info.get('dividendYield', 0)
-            dividend_yield_display = round(dividend_yield * 100, 2) if dividend_yield and dividend_yield > 0 else 0
-            
-            note = db.query(Note).filter_by(symbol=symbol).first()
-            notes_text = note.content if note else ""
+            notes_text = notes.get(symbol) or ""
             
             results.append({
                 "symbol": symbol,
                 "category": category,
-                "price": round(current_price, 2),
-                "yesterday": round(close.iloc[-2], 2) if len(close) > 1 else round(current_price, 2),
-                "perf": {
-                    "1d": get_pct_change(close, 1),
-                    "1m": get_pct_change(close, 21),
-                    "3m": get_pct_change(close, 63),
-                    "6m": get_pct_change(close, 126),
-                    "1y": get_pct_change(close, 252),
-                    "3y": get_pct_change(close, 756) if len(close) >= 756 else get_pct_change(close, len(close)-1)
-                },
-                "ma": {
-                    "50": round(ma50, 2) if not np.isnan(ma50) else "—",
-                    "100": round(ma100, 2) if not np.isnan(ma100) else "—",
-                    "250": round(ma250, 2) if not np.isnan(ma250) else "—"
-                },
-                "stats": {
-                    "pe": round(info.get('trailingPE', 0), 2) if info.get('trailingPE') else '—',
-                    "rsi": rsi,
-                    "eps": round(info.get('trailingEps', 0), 2) if info.get('trailingEps') else '—',
-                    "beta": round(info.get('beta', 0), 2) if info.get('beta') else '—',
-                    "sector": info.get('sector', '—'),
-                    "earnings": earnings_date_display,
-                    "avg_volume": round(avg_volume, 0) if not np.isnan(avg_volume) else '—',
-                    "volatility": round(volatility, 2) if not np.isnan(volatility) else '—',
-                    "market_cap": market_cap_display,
-                    "52w_high": round(info.get('fiftyTwoWeekHigh', 0), 2) if info.get('fiftyTwoWeekHigh') else '—',
-                    "52w_low": round(info.get('fiftyTwoWeekLow', 0), 2) if info.get('fiftyTwoWeekLow') else '—',
-                    "dividend_yield": dividend_yield_display
-                },
-                "sentiment": "Bullish" if current_price > ma250 else "Bearish",
+                **row,
                 "position": {
                     "quantity": quantity,
                     "avg_price": avg_price,
@@ -304,6 +231,110 @@ def get_screener(db: Session = Depends(get_db)):
     
     return results
 
+def _build_screener_in_session():
+    db = SessionLocal()
+    try:
+        return build_screener(db)
+    finally:
+        db.close()
+
+broadcaster = Broadcaster(_build_screener_in_session)
+on_publish(lambda snapshot: broadcaster.notify())
+
+def _check_alerts(snapshot):
+    try:
+        # Only the leader evaluates (a lone process becomes it); other workers relay what it recorded
+        if leadership.acquire():
+            evaluate_alerts(snapshot.metrics)
+        else:
+            relay_events()
+    except Exception as e:
+        print(f"Alert evaluation failed: {e}")
+
+def _watchlist_changed():
+    """Push a write to this worker's streams now and to the other workers' on their next poll"""
+    broadcaster.notify()
+    changed('watchlist')
+
+def _transactions_changed():
+    """After committing transaction writes: also drops every worker's cached portfolio analytics"""
+    changed('transactions')
+    _watchlist_changed()
+
+# Alerts fire on every refresh, whether or not anyone has the page open
+on_publish(_check_alerts)
+watch('alerts', lambda: leadership.is_leader and _check_alerts(current_snapshot()))
+watch('watchlist', broadcaster.notify)
+on_alert(lambda event: broadcaster.publish("alert", event))
+
+@app.get("/api/screener")
+def get_screener(
+    request: Request,
+    category: Optional[str] = None,
+    filters: List[str] = Query([], alias="filter"),
+    sort: Optional[str] = None,
+    order: str = "asc",
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    fields: Optional[str] = None,
+    format: str = "json",
+    db: Session = Depends(get_db)
+):
+    """Screener rows, optionally filtered (`filter=rsi<30&filter=price>ma250`),
+    sorted, paged and projected (`fields=price,stats.rsi`); the number of
+    matching rows is returned in X-Total-Count
+
+    `format=columnar` sends one array per field and `format=msgpack` the
+    same rows as MessagePack. Responses carry an ETag, so an unchanged
+    payload costs the client a 304.
+    """
+    if format not in PAYLOAD_FORMATS:
+        return {"status": "error", "message": f"Unknown format: {format}"}
+    if format == "msgpack" and not msgpack_available():
+        return {"status": "error", "message": "MessagePack encoding requires msgpack"}
+
+    with timed('build'):
+        rows = build_screener(db, category)
+    try:
+        with timed('query'):
+            total, rows = query_rows(
+                rows, current_snapshot().metrics,
+                filters=[f for value in filters for f in value.split(',') if f.strip()],
+                sort=sort,
+                descending=order == "desc",
+                offset=offset,
+                limit=limit,
+                fields=[f.strip() for f in fields.split(',') if f.strip()] if fields else None
+            )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    with timed('serialize'):
+        body = encode(rows, format)
+    return etag_response(request, body, MEDIA_TYPES[format], {"X-Total-Count": str(total)})
+
+@app.get("/api/stream")
+async def stream_screener(request: Request):
+    """Server-Sent Events: one full snapshot, then per-symbol deltas as data changes"""
+    async def events():
+        queue = await broadcaster.subscribe()
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield format_event(*message)
+        finally:
+            broadcaster.unsubscribe(queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @app.get("/api/categories")
 def get_categories(db: Session = Depends(get_db)):
     tickers = db.query(Ticker).all()
@@ -315,20 +346,79 @@ def get_categories(db: Session = Depends(get_db)):
     categories.sort()
     return ["All"] + categories
 
+# How long browsers may reuse each detail sub-resource before revalidating
+SUMMARY_MAX_AGE = 3600
+NEWS_MAX_AGE = 300
+HISTORY_MAX_AGE = 60
+
+def fetch_summary(symbol):
+    info = {}
+    try:
+        info = fetch_info(symbol) or {}
+    except Exception:
+        pass
+    return {
+        "symbol": symbol,
+        "name": info.get('longName') or info.get('shortName') or symbol,
+        "description": info.get('longBusinessSummary') or "No summary available.",
+        "sector": info.get('sector'),
+        "industry": info.get('industry'),
+        "website": info.get('website'),
+    }
+
 @app.get("/api/details/{symbol}")
 def get_details(symbol: str):
+    """Summary and news together; the detail panel loads them separately from the endpoints below"""
+    return {"description": fetch_summary(symbol)["description"], "news": fetch_news_enhanced(symbol)}
+
+@app.get("/api/details/{symbol}/summary")
+def get_details_summary(symbol: str, request: Request):
+    body = encode(fetch_summary(symbol.upper()))
+    return etag_response(request, body, MEDIA_TYPES["json"], {"Cache-Control": f"max-age={SUMMARY_MAX_AGE}"})
+
+@app.get("/api/details/{symbol}/news")
+def get_details_news(symbol: str, request: Request):
+    body = encode({"symbol": symbol.upper(), "news": fetch_news_enhanced(symbol.upper())})
+    return etag_response(request, body, MEDIA_TYPES["json"], {"Cache-Control": f"max-age={NEWS_MAX_AGE}"})
+
+@app.get("/api/history/{symbol}")
+def get_history(
+    symbol: str,
+    request: Request,
+    range: str = "1y",
+    resolution: str = "1d",
+    points: int = Query(DEFAULT_POINTS, ge=2),
+    method: str = "lttb",
+    db: Session = Depends(get_db)
+):
+    """Stored OHLCV for charting, reduced server-side to at most `points` points
+
+    `range` is 1m/3m/6m/ytd/1y/2y/5y/max and `resolution` 1d/1wk/1mo.
+    `method=lttb` keeps the shape of the close line, `minmax` keeps every
+    bucket's extremes and `ohlc` merges bars into candles. Served from the
+    price store only, so it never triggers a download.
+    """
     try:
-        t = yf.Ticker(symbol)
-        summary = "No summary available."
-        try:
-            info = t.info
-            summary = info.get('longBusinessSummary', summary) if info else summary
-        except:
-            pass
-        news = fetch_news_enhanced(symbol)
-        return {"description": summary, "news": news}
-    except Exception as e:
-        return {"description": f"Error loading {symbol}", "news": fetch_news_enhanced(symbol)}
+        with timed('history_chart'):
+            history = chart_history(db, symbol.upper(), range, resolution, points, method)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    if not history["points"]:
+        return {"status": "error", "message": f"No stored history for {symbol.upper()}"}
+    return etag_response(request, encode(history), MEDIA_TYPES["json"], {"Cache-Control": f"max-age={HISTORY_MAX_AGE}"})
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return {**cache_stats(), "upstream": upstream_stats()}
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of this worker's request, stage, upstream, DB, pool and cache metrics"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/provider")
+def get_provider_status():
+    return provider_status()
 
 @app.post("/api/add")
 def add_ticker(data: TickerModel, db: Session = Depends(get_db)):
@@ -343,6 +433,7 @@ def add_ticker(data: TickerModel, db: Session = Depends(get_db)):
     new_ticker = Ticker(symbol=symbol_up, category=data.category)
     db.add(new_ticker)
     db.commit()
+    _watchlist_changed()
     
     return {"status": "added"}
 
@@ -355,9 +446,13 @@ def delete_ticker(symbol: str, db: Session = Depends(get_db)):
         db.delete(ticker)
         db.query(Portfolio).filter_by(symbol=symbol_up).delete()
         db.query(Alert).filter_by(symbol=symbol_up).delete()
+        db.query(AlertRule).filter_by(symbol=symbol_up).delete()
         db.query(Note).filter_by(symbol=symbol_up).delete()
         db.query(Transaction).filter_by(symbol=symbol_up).delete()
+        db.query(PriceBar).filter_by(symbol=symbol_up).delete()
         db.commit()
+        invalidate_alerts()
+        _transactions_changed()
         return {"status": "deleted"}
     
     return {"status": "not_found"}
@@ -374,6 +469,9 @@ def add_transaction(symbol: str, transaction: TransactionModel, db: Session = De
             trans_date = datetime.fromisoformat(transaction.date)
         except:
             pass
+    # Stored dates are naive UTC; an offset would make them incomparable
+    if trans_date.tzinfo is not None:
+        trans_date = trans_date.astimezone(timezone.utc).replace(tzinfo=None)
     
     new_trans = Transaction(
         symbol=symbol_up,
@@ -384,7 +482,9 @@ def add_transaction(symbol: str, transaction: TransactionModel, db: Session = De
         notes=transaction.notes or ""
     )
     db.add(new_trans)
+    apply_transaction(db, new_trans)
     db.commit()
+    _transactions_changed()
     
     return {"status": "saved"}
 
@@ -410,7 +510,9 @@ def delete_transaction(trans_id: int, db: Session = Depends(get_db)):
     transaction = db.query(Transaction).filter_by(id=trans_id).first()
     if transaction:
         db.delete(transaction)
+        rebuild_symbol(db, transaction.symbol)
         db.commit()
+        _transactions_changed()
         return {"status": "deleted"}
     return {"status": "not_found"}
 
@@ -427,8 +529,61 @@ def update_alerts(symbol: str, alert_data: AlertModel, db: Session = Depends(get
         db.add(alert)
     
     db.commit()
+    invalidate_alerts()
+    _check_alerts(current_snapshot())
+    _watchlist_changed()
     return {"status": "saved"}
 
+@app.get("/api/portfolio/analytics")
+def get_portfolio_analytics(db: Session = Depends(get_db)):
+    """Equity curve, TWR/MWR, drawdown, FIFO P&L and correlation for the whole book"""
+    return portfolio_analytics(db)
+
+@app.post("/api/backtest")
+def backtest(request: BacktestModel, db: Session = Depends(get_db)):
+    """Evaluate a rule such as "close crosses above ma50 and rsi < 40" over all stored bars
+
+    Returns signal dates with forward returns; scan=true keeps only signals
+    on each symbol's latest bar.
+    """
+    symbols = [s.upper() for s in request.symbols] if request.symbols else [t.symbol for t in db.query(Ticker.symbol)]
+    try:
+        start = datetime.strptime(request.start, '%Y-%m-%d').date() if request.start else None
+        return run_backtest(db, request.rule, symbols, request.horizons, start, request.scan, request.max_signals)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/api/alerts/events")
+def get_alert_events(symbol: Optional[str] = None, limit: int = Query(50, ge=1, le=1000), db: Session = Depends(get_db)):
+    return recent_events(db, symbol.upper() if symbol else None, limit)
+
+@app.get("/api/alerts/{symbol}/rules")
+def get_alert_rules(symbol: str, db: Session = Depends(get_db)):
+    rules = db.query(AlertRule).filter_by(symbol=symbol.upper()).order_by(AlertRule.id).all()
+    return [{"id": r.id, "kind": r.kind, "value": r.value} for r in rules]
+
+@app.post("/api/alerts/{symbol}/rules")
+def add_alert_rule(symbol: str, rule: AlertRuleModel, db: Session = Depends(get_db)):
+    """Indicator alert: rsi_above/rsi_below a level, or ma_cross_above/ma_cross_below (MA50 vs MA250)"""
+    if rule.kind not in RULE_KINDS:
+        return {"status": "error", "message": f"Unknown rule kind: {rule.kind}"}
+    if rule.kind.startswith('rsi') and rule.value is None:
+        return {"status": "error", "message": "RSI rules need a value"}
+    
+    new_rule = AlertRule(symbol=symbol.upper(), kind=rule.kind, value=rule.value)
+    db.add(new_rule)
+    db.commit()
+    invalidate_alerts()
+    _check_alerts(current_snapshot())
+    return {"status": "saved", "id": new_rule.id}
+
+@app.delete("/api/alerts/rules/{rule_id}")
+def delete_alert_rule(rule_id: int, db: Session = Depends(get_db)):
+    deleted = db.query(AlertRule).filter_by(id=rule_id).delete()
+    db.commit()
+    invalidate_alerts()
+    return {"status": "deleted" if deleted else "not_found"}
+
 @app.post("/api/notes/{symbol}")
 def update_notes(symbol: str, note_data: NoteModel, db: Session = Depends(get_db)):
     symbol_up = symbol.upper()
@@ -441,6 +596,7 @@ def update_notes(symbol: str, note_data: NoteModel, db: Session = Depends(get_db
         db.add(note)
     
     db.commit()
+    _watchlist_changed()
     return {"status": "saved"}
 
 @app.get("/api/theme")
@@ -463,86 +619,29 @@ def set_theme(theme: str, db: Session = Depends(get_db)):
     return {"theme": theme}
 
 @app.get("/api/export")
-def export_watchlist(db: Session = Depends(get_db)):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Symbol', 'Category', 'Quantity', 'Avg_Price', 'Alert_High', 'Alert_Low', 'Notes'])
-    
-    tickers = db.query(Ticker).all()
-    
-    for t in tickers:
-        pos_data = calculate_portfolio_from_transactions(t.symbol, db)
-        alert = db.query(Alert).filter_by(symbol=t.symbol).first()
-        note = db.query(Note).filter_by(symbol=t.symbol).first()
-        
-        writer.writerow([
-            t.symbol,
-            t.category,
-            pos_data['quantity'],
-            pos_data['avg_price'],
-            alert.high if alert else '',
-            alert.low if alert else '',
-            note.content if note else ''
-        ])
-    
-    output.seek(0)
-    return {"csv": output.getvalue()}
+def export_data(dataset: str = "watchlist", format: str = "csv", gzip: bool = False):
+    if dataset not in DATASETS:
+        return {"status": "error", "message": f"Unknown dataset: {dataset}"}
+    if format not in FORMATS:
+        return {"status": "error", "message": f"Unknown format: {format}"}
+    if format == "parquet" and not parquet_available():
+        return {"status": "error", "message": "Parquet export requires pyarrow"}
+
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/vnd.apache.parquet")
+    filename = export_filename(dataset, format, gzip)
+    return StreamingResponse(
+        export_stream(dataset, format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @app.post("/api/import")
-async def import_watchlist(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    contents = await file.read()
-    decoded = contents.decode('utf-8')
-    reader = csv.DictReader(io.StringIO(decoded))
-    
-    imported = 0
-    for row in reader:
-        try:
-            symbol = row['Symbol'].upper()
-            category = row.get('Category', 'Short Term')
-            
-            existing = db.query(Ticker).filter_by(symbol=symbol).first()
-            if not existing:
-                ticker = Ticker(symbol=symbol, category=category)
-                db.add(ticker)
-                imported += 1
-            
-            if row.get('Quantity') and row.get('Avg_Price'):
-                qty = float(row['Quantity'])
-                price = float(row['Avg_Price'])
-                if qty > 0:
-                    trans = Transaction(symbol=symbol, transaction_type='BUY', quantity=qty, price=price, date=datetime.now())
-                    db.add(trans)
-            
-            if row.get('Alert_High') or row.get('Alert_Low'):
-                alert = db.query(Alert).filter_by(symbol=symbol).first()
-                if alert:
-                    if row.get('Alert_High'):
-                        alert.high = float(row['Alert_High'])
-                    if row.get('Alert_Low'):
-                        alert.low = float(row['Alert_Low'])
-                else:
-                    alert = Alert(
-                        symbol=symbol,
-                        high=float(row['Alert_High']) if row.get('Alert_High') else None,
-                        low=float(row['Alert_Low']) if row.get('Alert_Low') else None
-                    )
-                    db.add(alert)
-            
-            if row.get('Notes'):
-                note = db.query(Note).filter_by(symbol=symbol).first()
-                if note:
-                    note.content = row['Notes']
-                else:
-                    note = Note(symbol=symbol, content=row['Notes'])
-                    db.add(note)
-                    
-        except Exception as e:
-            print(f"Import error: {e}")
-            continue
-    
-    db.commit()
-    return {"status": "imported", "count": imported}
+def import_watchlist(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    result = import_csv(file.file, db)
+    invalidate_alerts()
+    _transactions_changed()
+    return {"status": "imported", **result}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=int(os.getenv('WEB_CONCURRENCY', '1')))
@@ -0,0 +1,503 @@
+import pandas as pd
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy import func, select, cast, String
+from sqlalchemy.orm import Session
+import os
+import time
+import threading
+
+from database import SessionLocal, PriceBar, IndicatorState
+from cache import TTLCache, SingleFlight
+from shared import store, changed, generation
+from resilience import deadline
+from providers import create_provider, BAR_COLUMNS
+from indicators import RunningIndicators, compute_indicators, price_matrix
+from metrics import timed, histogram, upstream_errors, upstream_timeouts, register_collector
+
+HISTORY_PERIOD = "5y"
+HISTORY_YEARS = 5
+
+# Bounded fan-out for the per-symbol upstream calls
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '8'))
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', '20'))
+# Hard limit on the upstream part of one screener refresh; whatever is unfinished by then is served from cache
+REFRESH_DEADLINE = float(os.getenv('REFRESH_DEADLINE', '120'))
+# Fundamentals change daily at most; news a few times an hour
+INFO_TTL = float(os.getenv('INFO_TTL', str(12 * 3600)))
+NEWS_TTL = float(os.getenv('NEWS_TTL', '900'))
+CACHE_SIZE = int(os.getenv('CACHE_SIZE', '1000'))
+
+provider = create_provider(FETCH_TIMEOUT)
+
+# Written through to the shared store so every worker reuses the others' fetches
+info_cache = TTLCache('info', ttl=INFO_TTL, stale_for=7 * 24 * 3600, maxsize=CACHE_SIZE, store=store)
+news_cache = TTLCache('news', ttl=NEWS_TTL, stale_for=24 * 3600, maxsize=CACHE_SIZE, store=store)
+# At most one upstream call per (kind, symbol) at a time, however many callers want it
+in_flight = SingleFlight(timeout=FETCH_TIMEOUT)
+# One pool for every refresh, so FETCH_WORKERS caps upstream concurrency even while abandoned tasks finish
+_fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='upstream')
+# (kind, symbol) keys of tasks still running on the pool, abandoned ones included
+_running = set()
+_running_lock = threading.Lock()
+
+symbol_indicator_seconds = histogram('symbol_indicator_seconds', "Incremental indicator update per symbol",
+                                     buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+# Top-ups re-fetch a few completed bars so split/dividend re-adjustments can be spotted
+OVERLAP_DAYS = 7
+ADJUST_TOLERANCE = 1e-4
+
+def history_generation():
+    """Bumped, in every worker's view, whenever stored history is (re)written beyond the top-up overlap
+
+    In-memory copies of the bars compare it to know when to reload instead
+    of topping up.
+    """
+    return generation('history')
+
+def history_start():
+    """First date kept in the rolling history window"""
+    today = date.today()
+    try:
+        return today.replace(year=today.year - HISTORY_YEARS)
+    except ValueError:
+        # Feb 29 -> Feb 28
+        return (today - timedelta(days=1)).replace(year=today.year - HISTORY_YEARS)
+
+def store_bars(symbol: str, hist: pd.DataFrame, db: Session):
+    """Replace stored bars from the first fetched date onwards with the fetched ones"""
+    hist = hist.dropna(subset=['Close'])
+    if hist.empty:
+        return 0
+
+    dates = [ts.date() for ts in hist.index]
+    rows = [{
+        'symbol': symbol,
+        'date': d,
+        'open': float(row.Open) if pd.notna(row.Open) else None,
+        'high': float(row.High) if pd.notna(row.High) else None,
+        'low': float(row.Low) if pd.notna(row.Low) else None,
+        'close': float(row.Close),
+        'volume': float(row.Volume) if pd.notna(row.Volume) else 0
+    } for d, row in zip(dates, hist.itertuples())]
+
+    # The last stored bar may have been an intraday snapshot, so overwrite the overlap
+    db.query(PriceBar).filter(PriceBar.symbol == symbol, PriceBar.date >= min(dates)).delete(synchronize_session=False)
+    db.bulk_insert_mappings(PriceBar, rows)
+    return len(rows)
+
+def load_history(symbol: str, db: Session):
+    """Read the stored history window for a symbol as an OHLCV DataFrame"""
+    return load_histories([symbol], db).get(symbol, _bars_frame([]))
+
+def load_histories(symbols, db: Session):
+    """Read the stored history window for many symbols in one query"""
+    if not symbols:
+        return {}
+    bars = db.query(PriceBar).filter(
+        PriceBar.symbol.in_(symbols),
+        PriceBar.date >= history_start()
+    ).order_by(PriceBar.symbol, PriceBar.date).all()
+
+    by_symbol = {}
+    for b in bars:
+        by_symbol.setdefault(b.symbol, []).append(b)
+    return {symbol: _bars_frame(rows) for symbol, rows in by_symbol.items()}
+
+def load_bar_matrices(db: Session, symbols, start=None, columns=('close',)):
+    """Date x symbol matrices of stored bar columns, e.g. {'close': DataFrame}
+
+    Reads plain columns with one Core query straight off the DBAPI cursor;
+    dates come back as text and are parsed in one vectorized call, which
+    is several times faster than per-row ORM/Date processing for hundreds
+    of symbols.
+    """
+    columns = list(columns)
+    stmt = select(cast(PriceBar.date, String), PriceBar.symbol, *[getattr(PriceBar, c) for c in columns]) \
+        .where(PriceBar.symbol.in_(symbols))
+    if start is not None:
+        stmt = stmt.where(PriceBar.date >= start)
+    result = db.connection().execute(stmt)
+    try:
+        rows = result.cursor.fetchall()
+    finally:
+        result.close()
+    frame = pd.DataFrame.from_records(rows, columns=['date', 'symbol'] + columns)
+    if frame.empty:
+        return {c: pd.DataFrame(columns=symbols, dtype=float) for c in columns}
+    frame['date'] = pd.to_datetime(frame['date'].str[:10], format='%Y-%m-%d')
+    wide = frame.set_index(['date', 'symbol']).unstack('symbol').sort_index()
+    return {c: wide[c].reindex(columns=symbols).astype(float) for c in columns}
+
+def _bars_frame(bars):
+    return pd.DataFrame(
+        [(b.open, b.high, b.low, b.close, b.volume) for b in bars],
+        index=pd.DatetimeIndex([b.date for b in bars], name='Date'),
+        columns=BAR_COLUMNS
+    )
+
+def download_bars(symbols, **kwargs):
+    """Download OHLCV as {symbol: DataFrame}; concurrent identical requests share one call"""
+    symbols = list(symbols)
+    key = ('history', tuple(symbols), tuple(sorted(kwargs.items())))
+    return in_flight.do(key, lambda: _upstream('history', provider.download, symbols, **kwargs))
+
+def plan_downloads(symbols, db: Session):
+    """Download arguments per symbol
+
+    Symbols without stored bars get a full backfill; the rest are topped up
+    from shortly before their own last stored date.
+    """
+    last_dates = dict(
+        db.query(PriceBar.symbol, func.max(PriceBar.date))
+        .filter(PriceBar.symbol.in_(symbols))
+        .group_by(PriceBar.symbol)
+        .all()
+    )
+    plans = []
+    for symbol in symbols:
+        if symbol in last_dates:
+            start = last_dates[symbol] - timedelta(days=OVERLAP_DAYS)
+            plans.append((symbol, {'start': start.isoformat()}))
+        else:
+            plans.append((symbol, {'period': HISTORY_PERIOD}))
+    return plans
+
+def find_adjusted(frames, db: Session):
+    """Symbols whose already-stored completed bars came back with different prices
+
+    yfinance returns split/dividend adjusted prices, so a corporate action
+    rescales the whole history; those symbols need a fresh backfill.
+    """
+    if not frames:
+        return []
+    start = min(bars.index[0] for bars in frames.values() if not bars.empty).date()
+    stored = {}
+    for symbol, day, close in db.query(PriceBar.symbol, PriceBar.date, PriceBar.close).filter(
+        PriceBar.symbol.in_(list(frames)),
+        PriceBar.date >= start
+    ):
+        stored.setdefault(symbol, {})[day] = close
+
+    adjusted = []
+    for symbol, bars in frames.items():
+        closes = stored.get(symbol)
+        if not closes:
+            continue
+        # The latest stored bar may have been intraday, so it is allowed to differ
+        latest = max(closes)
+        for ts, close in bars['Close'].items():
+            old = closes.get(ts.date())
+            if old is not None and ts.date() != latest and abs(close - old) > ADJUST_TOLERANCE * abs(old):
+                adjusted.append(symbol)
+                break
+    return adjusted
+
+def refresh_bars(symbol, download_kwargs):
+    """Download one symbol's bars and merge them into the store (runs in a worker thread)"""
+    frames = download_bars([symbol], **download_kwargs)
+    db = SessionLocal()
+    try:
+        adjusted = find_adjusted(frames, db) if 'start' in download_kwargs else []
+        for symbol, bars in frames.items():
+            if symbol not in adjusted:
+                store_bars(symbol, bars, db)
+
+        if adjusted:
+            print(f"Re-adjusted history, backfilling: {', '.join(adjusted)}")
+            db.query(PriceBar).filter(PriceBar.symbol.in_(adjusted)).delete(synchronize_session=False)
+            for symbol, bars in download_bars(adjusted, period=HISTORY_PERIOD).items():
+                store_bars(symbol, bars, db)
+        db.commit()
+        if adjusted or 'start' not in download_kwargs:
+            changed('history')
+    finally:
+        db.close()
+    return len(frames)
+
+def fetch_info(symbol: str):
+    """Read fundamentals for one symbol through the info cache
+
+    yfinance has no multi-symbol equivalent, so this stays per ticker.
+    """
+    try:
+        return info_cache.get(symbol, lambda: in_flight.do(('info', symbol), lambda: _upstream('info', provider.info, symbol)))
+    except Exception:
+        # Counted in upstream_errors_total; the breaker logs sustained trouble
+        return {}
+
+def fetch_news(symbol: str):
+    """Raw news items for one symbol through the news cache"""
+    return news_cache.get(symbol, lambda: in_flight.do(('news', symbol), lambda: _upstream('news', provider.news, symbol)))
+
+def _upstream(call, fn, *args, **kwargs):
+    try:
+        with timed(call):
+            return fn(*args, **kwargs)
+    except Exception:
+        upstream_errors.inc(call=call)
+        raise
+
+def cache_stats():
+    return {cache.kind: cache.stats() for cache in (info_cache, news_cache)}
+
+def upstream_stats():
+    return in_flight.stats()
+
+@register_collector
+def _cache_metrics():
+    stats = cache_stats()
+    families = []
+    for field, kind, help in (
+        ('hits', 'counter', "Fresh cache hits"),
+        ('stale_hits', 'counter', "Stale hits served while refreshing"),
+        ('misses', 'counter', "Cache misses fetched synchronously"),
+        ('refresh_errors', 'counter', "Failed background refreshes"),
+        ('fallbacks', 'counter', "Expired values served because the fetch failed"),
+        ('evictions', 'counter', "Entries evicted by the size bound"),
+        ('size', 'gauge', "Entries currently cached"),
+        ('hit_ratio', 'gauge', "Fresh plus stale hits over lookups"),
+    ):
+        name = f"cache_{field}_total" if kind == 'counter' else f"cache_{field}"
+        families.append((name, kind, help, [({'cache': cache}, s[field]) for cache, s in stats.items()]))
+    calls = in_flight.stats()
+    families.append(('upstream_calls_total', 'counter', "Upstream calls actually made",
+                     [({'call': call}, c['executed']) for call, c in calls.items()]))
+    families.append(('upstream_deduplicated_total', 'counter', "Callers served by another caller's in-flight upstream call",
+                     [({'call': call}, c['deduplicated']) for call, c in calls.items()]))
+    families.append(('upstream_in_flight', 'gauge', "Upstream calls currently running",
+                     [({'call': call}, c['in_flight']) for call, c in calls.items()]))
+    families.append(('upstream_tasks_running', 'gauge', "Refresh tasks on the upstream pool, abandoned ones included",
+                     [({}, len(_running))]))
+    status = provider_status()
+    families.append(('provider_failed_over', 'gauge', "1 while market data is served from replay",
+                     [({'provider': status['provider']}, int(status['failed_over']))]))
+    if 'failovers' in status:
+        families.append(('provider_failovers_total', 'counter', "Switches from live to replay",
+                         [({}, status['failovers'])]))
+    return families
+
+def provider_status():
+    if hasattr(provider, 'status'):
+        return provider.status()
+    return {"provider": provider.name, "failed_over": False, "replay_dir": provider.directory}
+
+def run_bounded(tasks, timeout: float = None, until: float = None):
+    """Run {key: callable} on the shared upstream pool
+
+    Returns {key: result}. Tasks that raise or run past the timeout (counted
+    from when a worker starts them, not from submission) are left out, as is
+    everything unfinished at the monotonic deadline `until`. Rate-limit waits
+    and retries inside a task stop at whichever limit comes first. A key whose
+    task from an earlier call is still running is not submitted again.
+    """
+    timeout = timeout or FETCH_TIMEOUT
+    results = {}
+    if not tasks:
+        return results
+
+    started = {}
+
+    def run(key, fn):
+        started[key] = time.monotonic()
+        limit = started[key] + timeout
+        try:
+            with deadline(min(limit, until) if until else limit):
+                return fn()
+        finally:
+            with _running_lock:
+                _running.discard(key)
+
+    with _running_lock:
+        busy = [key for key in tasks if key in _running]
+        submit = {key: fn for key, fn in tasks.items() if key not in _running}
+        _running.update(submit)
+    if busy:
+        print(f"Skipping {len(busy)} upstream tasks still running from an earlier refresh")
+    futures = {_fetch_pool.submit(run, key, fn): key for key, fn in submit.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    print(f"Error: {key}: {e}")
+
+            now = time.monotonic()
+            if until and now >= until and pending:
+                upstream_timeouts.inc(len(pending), call='deadline')
+                print(f"⏱️ Refresh deadline reached, {len(pending)} upstream tasks left to the cache")
+                break
+            for future in list(pending):
+                key = futures[future]
+                if key in started and now - started[key] > timeout:
+                    pending.discard(future)
+                    upstream_timeouts.inc(call=key[0] if isinstance(key, tuple) else 'task')
+                    print(f"Timeout: {key} after {timeout:.0f}s")
+    finally:
+        # Queued tasks are dropped; running ones cannot be stopped and keep their key busy until they return
+        for future in pending:
+            if future.cancel():
+                with _running_lock:
+                    _running.discard(futures[future])
+
+    return results
+
+def fetch_all(symbols, timeout: float = None, until: float = None):
+    """Top up every symbol's stored history and read its info, one bounded task each
+
+    Returns ({symbol: info}, unfinished); indicator values come from
+    update_indicators. Everything is bounded by REFRESH_DEADLINE (or
+    `until`): symbols whose info did not arrive in time get their last cached
+    info, and those whose bars did not keep their stored history and are
+    listed in `unfinished`. Symbols whose bars are still downloading from an
+    earlier refresh are left out of the plan and count as unfinished.
+    """
+    if not symbols:
+        return {}, set()
+
+    with _running_lock:
+        in_flight_bars = {symbol for symbol in symbols if ('bars', symbol) in _running}
+    if in_flight_bars:
+        print(f"Skipping bars for {len(in_flight_bars)} symbols still downloading from an earlier refresh")
+
+    db = SessionLocal()
+    try:
+        plans = plan_downloads([s for s in symbols if s not in in_flight_bars], db)
+    finally:
+        db.close()
+
+    tasks = {}
+    for symbol, download_kwargs in plans:
+        tasks[('bars', symbol)] = lambda symbol=symbol, kw=download_kwargs: refresh_bars(symbol, kw)
+    for symbol in symbols:
+        tasks[('info', symbol)] = lambda symbol=symbol: fetch_info(symbol)
+    results = run_bounded(tasks, timeout, until or time.monotonic() + REFRESH_DEADLINE)
+
+    infos = {symbol: results.get(('info', symbol)) or info_cache.peek(symbol) or {} for symbol in symbols}
+    unfinished = {symbol for symbol in symbols if ('bars', symbol) not in results}
+    return infos, unfinished
+
+# In-process copy of the indicator_state table, plus the (first, last) dates last persisted
+_states = {}
+_persisted = {}
+_states_lock = threading.Lock()
+
+def update_indicators(symbols):
+    """Bring each symbol's running indicators up to date with the price store
+
+    Symbols with state only fold in bars from their last date onwards and
+    drop bars that left the history window, which is O(1) per symbol. Symbols
+    without state, or whose stored history was re-adjusted, are rebuilt from
+    the full history through the vectorized engine.
+
+    Returns {symbol: indicator row}; symbols without stored bars are left out.
+    """
+    with _states_lock:
+        db = SessionLocal()
+        try:
+            return _update_indicators(list(symbols), db)
+        finally:
+            db.close()
+
+def _update_indicators(symbols, db: Session):
+    window_start = history_start()
+
+    unloaded = [s for s in symbols if s not in _states]
+    if unloaded:
+        for row in db.query(IndicatorState).filter(IndicatorState.symbol.in_(unloaded)):
+            try:
+                _states[row.symbol] = RunningIndicators.from_dict(row.state)
+                _persisted[row.symbol] = (row.first_date, row.last_date)
+            except Exception as e:
+                print(f"Indicator state for {row.symbol} unreadable, rebuilding: {e}")
+
+    incremental = [s for s in symbols if s in _states]
+    rebuild = [s for s in symbols if s not in _states]
+
+    if incremental:
+        since = min(_states[s].last_date for s in incremental) - timedelta(days=OVERLAP_DAYS)
+        recent = {}
+        for b in db.query(PriceBar).filter(
+            PriceBar.symbol.in_(incremental),
+            PriceBar.date >= since
+        ).order_by(PriceBar.symbol, PriceBar.date):
+            recent.setdefault(b.symbol, []).append(b)
+
+        for symbol in incremental:
+            started = time.perf_counter()
+            if not _apply_bars(symbol, _states[symbol], recent.get(symbol, []), window_start, db):
+                rebuild.append(symbol)
+            symbol_indicator_seconds.observe(time.perf_counter() - started)
+
+    metrics = {s: _states[s].metrics() for s in incremental if s not in rebuild}
+
+    if rebuild:
+        histories = {s: h for s, h in load_histories(rebuild, db).items() if not h.empty}
+        rebuilt = compute_indicators(price_matrix(histories, 'Close'), price_matrix(histories, 'Volume'))
+        metrics.update(rebuilt.to_dict('index'))
+        for symbol in rebuild:
+            _states.pop(symbol, None)
+        for symbol, hist in histories.items():
+            _states[symbol] = RunningIndicators.from_history(hist)
+
+    _persist_states([s for s in symbols if s in _states], set(rebuild), window_start, db)
+    return metrics
+
+def _apply_bars(symbol, state, bars, window_start, db: Session):
+    """Fold stored bars into a running state; False when it has to be rebuilt"""
+    prior = [b for b in bars if b.date < state.last_date]
+    newer = [b for b in bars if b.date >= state.last_date]
+    if not newer or newer[0].date != state.last_date:
+        return False
+    if prior and state.bars > 1:
+        old = state.closes[-2]
+        if abs(prior[-1].close - old) > ADJUST_TOLERANCE * abs(old):
+            return False
+
+    state.update_last(newer[0].close, newer[0].volume)
+    for b in newer[1:]:
+        state.push(b.date, b.close, b.volume)
+
+    if state.first_date < window_start:
+        # Bars before the window are only pruned once the state has dropped them
+        expiring = db.query(PriceBar.date, PriceBar.close).filter(
+            PriceBar.symbol == symbol,
+            PriceBar.date > state.first_date
+        ).order_by(PriceBar.date).limit(OVERLAP_DAYS * 5).all()
+        for day, close in expiring:
+            if state.first_date >= window_start:
+                break
+            state.drop_first(day, close)
+        if state.first_date < window_start:
+            return False
+    return True
+
+def _persist_states(symbols, rebuilt, window_start, db: Session):
+    """Write rebuilt states and those whose window moved, then prune bars no state needs"""
+    dirty = [
+        s for s in symbols
+        if s in rebuilt or _persisted.get(s) != (_states[s].first_date, _states[s].last_date)
+    ]
+    if dirty:
+        db.query(IndicatorState).filter(IndicatorState.symbol.in_(dirty)).delete(synchronize_session=False)
+        db.bulk_insert_mappings(IndicatorState, [{
+            'symbol': s,
+            'first_date': _states[s].first_date,
+            'last_date': _states[s].last_date,
+            'state': _states[s].to_dict()
+        } for s in dirty])
+
+    if symbols:
+        db.query(PriceBar).filter(
+            PriceBar.symbol.in_(symbols),
+            PriceBar.date < window_start
+        ).delete(synchronize_session=False)
+    db.commit()
+
+    for s in dirty:
+        _persisted[s] = (_states[s].first_date, _states[s].last_date)
@@ -0,0 +1,242 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import threading
+import time
+
+# Send a Server-Timing header on every response, not only when asked for with X-Timing: 1
+TIMING_HEADER = os.getenv('TIMING_HEADER', '0') == '1'
+METRICS_PREFIX = 'pulse_'
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Stage durations of the request being served, for its Server-Timing header
+_request_timings = ContextVar('request_timings', default=None)
+
+_metrics = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+def _label_text(names, values, *extra):
+    pairs = [f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+             for n, v in zip(names, values)]
+    pairs.extend(e for e in extra if e)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labels, key, value) for key, value in sorted(self._values.items())]
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        for key, counts, total in items:
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                running += count
+                out.append((f"{self.name}_bucket", self.labels, key, running, f'le="{_number(bound)}"'))
+            out.append((f"{self.name}_sum", self.labels, key, round(total, 6)))
+            out.append((f"{self.name}_count", self.labels, key, running))
+        return out
+
+def _register(metric):
+    with _registry_lock:
+        existing = _metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        _metrics[metric.name] = metric
+        return metric
+
+def counter(name, help, labels=()):
+    return _register(Counter(METRICS_PREFIX + name, help, labels))
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(METRICS_PREFIX + name, help, labels, buckets))
+
+def register_collector(fn):
+    """fn() -> [(name, type, help, [(labels dict, value)])], read on every scrape (gauges, derived counters)"""
+    _collectors.append(fn)
+    return fn
+
+http_requests = counter('http_requests_total', "HTTP requests served", ('method', 'route', 'status'))
+http_seconds = histogram('http_request_seconds', "Time to serve a request, until the last body byte", ('method', 'route'))
+stage_seconds = histogram('stage_seconds', "Time spent per stage: upstream calls, indicators, screener build, serialization", ('stage',))
+upstream_errors = counter('upstream_errors_total', "Failed upstream market data calls", ('call',))
+upstream_timeouts = counter('upstream_timeouts_total', "Upstream tasks abandoned after FETCH_TIMEOUT", ('call',))
+db_seconds = histogram('db_query_seconds', "Database statement execution time", ('operation',))
+
+@contextmanager
+def timed(stage):
+    """Observe the block's duration under stage_seconds{stage} and the current request's Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        record_timing(stage, elapsed)
+
+def record_timing(stage, elapsed):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def instrument_engine(engine):
+    """Time every statement the engine executes, labelled by its leading keyword"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('query_started')
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else 'unknown'
+        db_seconds.observe(elapsed, operation=operation)
+        record_timing('db', elapsed)
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        stack = context.connection.info.get('query_started') if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+    def pool_usage():
+        pool = engine.pool
+        gauges = []
+        for name, attr, help in (
+            ('db_pool_size', 'size', "Configured connection pool size"),
+            ('db_pool_checked_out', 'checkedout', "Connections currently in use"),
+            ('db_pool_checked_in', 'checkedin', "Idle connections in the pool"),
+            ('db_pool_overflow', 'overflow', "Connections opened beyond the pool size"),
+        ):
+            if hasattr(pool, attr):
+                gauges.append((name, 'gauge', help, [({}, getattr(pool, attr)())]))
+        return gauges
+
+    register_collector(pool_usage)
+
+def render():
+    """Every metric in the Prometheus text exposition format (version 0.0.4)
+
+    Counters live in each worker process, so every sample carries a
+    worker="<pid>" label; sum without(worker) for the service-wide value.
+    """
+    worker = f'worker="{os.getpid()}"'
+    lines = []
+    with _registry_lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for sample in metric.samples():
+            name, names, values, value = sample[:4]
+            extra = sample[4] if len(sample) > 4 else ''
+            lines.append(f"{name}{_label_text(names, values, worker, extra)} {_number(value)}")
+    for collector in _collectors:
+        try:
+            families = collector()
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+            continue
+        for name, kind, help, samples in families:
+            name = METRICS_PREFIX + name
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(list(labels), list(labels.values()), worker)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+def server_timing(timings, total):
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings.items()]
+    return ', '.join(parts + [f"total;dur={total * 1000:.1f}"])
+
+class MetricsMiddleware:
+    """ASGI middleware: request count and latency per route, plus the opt-in Server-Timing header
+
+    Routes are labelled by their template (/api/details/{symbol}), so
+    per-symbol paths do not each become a time series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        timings = {}
+        token = _request_timings.set(timings)
+        wants_timing = TIMING_HEADER or any(
+            k == b'x-timing' and v.strip() in (b'1', b'true') for k, v in scope.get('headers', []))
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                if wants_timing:
+                    value = server_timing(timings, time.perf_counter() - started)
+                    message = {**message, 'headers': list(message.get('headers', [])) + [(b'server-timing', value.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            elapsed = time.perf_counter() - started
+            http_requests.inc(method=scope['method'], route=path, status=status[0])
+            http_seconds.observe(elapsed, method=scope['method'], route=path)
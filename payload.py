@@ -0,0 +1,63 @@
+from fastapi import Request, Response
+import hashlib
+import json
+
+FORMATS = ('json', 'columnar', 'msgpack')
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'columnar': 'application/json',
+    'msgpack': 'application/msgpack',
+}
+
+def _plain(value):
+    # numpy scalars carry .item(); anything else unexpected is sent as text
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def _flatten(row, prefix=''):
+    flat = {}
+    for key, value in row.items():
+        # alerts only holds the thresholds that are set, so it stays one object
+        if isinstance(value, dict) and key != 'alerts':
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def columnar(rows):
+    """One array per (dotted) field instead of one object per row: {"fields": [...], "columns": {...}}"""
+    flat = [_flatten(row) for row in rows]
+    fields = []
+    for row in flat:
+        for key in row:
+            if key not in fields:
+                fields.append(key)
+    return {"fields": fields, "columns": {field: [row.get(field) for row in flat] for field in fields}}
+
+def msgpack_available():
+    try:
+        import msgpack  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def encode(data, fmt='json'):
+    """Serialize a payload in one of FORMATS, skipping FastAPI's per-value encoder"""
+    if fmt == 'columnar':
+        data = columnar(data)
+    if fmt == 'msgpack':
+        import msgpack
+        return msgpack.packb(data, default=_plain)
+    return json.dumps(data, separators=(',', ':'), default=_plain).encode('utf-8')
+
+def etag_response(request: Request, body: bytes, media_type: str, headers=None):
+    """Response with a content-hash ETag; 304 without a body when the client already has it
+
+    Cache-Control defaults to no-cache (always revalidate); pass one in
+    `headers` to let clients reuse the response for a while.
+    """
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    headers = {"Cache-Control": "no-cache", **(headers or {}), "ETag": etag}
+    known = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in known or "*" in known:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
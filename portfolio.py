@@ -0,0 +1,215 @@
+from sqlalchemy import func, case, inspect
+from sqlalchemy.orm import Session
+from datetime import datetime
+from types import SimpleNamespace
+import argparse
+
+from database import SessionLocal, Transaction, Portfolio, Alert, Note, Settings, upsert
+
+EMPTY_POSITION = {'quantity': 0, 'avg_price': 0}
+
+# Bump to force a full ledger rebuild on the next startup
+LEDGER_VERSION = '1'
+LEDGER_COLUMNS = ['symbol', 'quantity', 'avg_price', 'cost_basis', 'book_cost',
+                  'realized_pnl', 'trade_count', 'last_trade_date']
+
+def _position(quantity, cost):
+    if not quantity or quantity <= 0:
+        return dict(EMPTY_POSITION)
+
+    # Weighted average
+    avg_price = (cost or 0) / quantity
+    return {'quantity': round(quantity, 4), 'avg_price': round(avg_price, 2)}
+
+def load_positions(db: Session, symbols=None):
+    """Positions for every symbol from the ledger, in one query"""
+    query = db.query(Portfolio.symbol, Portfolio.quantity, Portfolio.cost_basis)
+    if symbols is not None:
+        query = query.filter(Portfolio.symbol.in_(symbols))
+    return {symbol: _position(quantity, cost) for symbol, quantity, cost in query}
+
+def aggregate_positions(db: Session, symbols=None):
+    """Positions recomputed from the raw transactions with one GROUP BY (used to check the ledger)"""
+    is_buy = Transaction.transaction_type == 'BUY'
+    is_sell = Transaction.transaction_type == 'SELL'
+    query = db.query(
+        Transaction.symbol,
+        func.sum(case((is_buy, Transaction.quantity), else_=0)),
+        func.sum(case((is_sell, Transaction.quantity), else_=0)),
+        func.sum(case((is_buy, Transaction.quantity * Transaction.price), else_=0)),
+        func.sum(case((is_sell, Transaction.quantity * Transaction.price), else_=0))
+    )
+    if symbols is not None:
+        query = query.filter(Transaction.symbol.in_(symbols))
+    return {
+        symbol: _position((bought or 0) - (sold or 0), (buy_cost or 0) - (sell_value or 0))
+        for symbol, bought, sold, buy_cost, sell_value in query.group_by(Transaction.symbol)
+    }
+
+def load_alerts(db: Session, symbols=None):
+    query = db.query(Alert)
+    if symbols is not None:
+        query = query.filter(Alert.symbol.in_(symbols))
+    return {alert.symbol: alert for alert in query}
+
+def load_notes(db: Session, symbols=None):
+    query = db.query(Note.symbol, Note.content)
+    if symbols is not None:
+        query = query.filter(Note.symbol.in_(symbols))
+    return {symbol: content for symbol, content in query}
+
+def calculate_portfolio_from_transactions(symbol: str, db: Session):
+    """Calculate portfolio stats from transaction history"""
+    return load_positions(db, [symbol]).get(symbol, dict(EMPTY_POSITION))
+
+def _reset(row):
+    row.quantity = 0
+    row.avg_price = 0
+    row.cost_basis = 0
+    row.book_cost = 0
+    row.realized_pnl = 0
+    row.trade_count = 0
+    row.last_trade_date = None
+
+def _apply(row, transaction_type, quantity, price, date):
+    if transaction_type == 'BUY':
+        row.quantity += quantity
+        row.cost_basis += quantity * price
+        row.book_cost += quantity * price
+    elif transaction_type == 'SELL':
+        avg_cost = row.book_cost / row.quantity if row.quantity > 0 else 0
+        row.realized_pnl += quantity * (price - avg_cost)
+        row.book_cost = max(row.book_cost - quantity * avg_cost, 0)
+        row.quantity -= quantity
+        row.cost_basis -= quantity * price
+    else:
+        return
+    row.avg_price = row.cost_basis / row.quantity if row.quantity > 0 else 0
+    row.trade_count += 1
+    if row.last_trade_date is None or date > row.last_trade_date:
+        row.last_trade_date = date
+
+def _ledger_row(db: Session, symbol: str):
+    row = db.query(Portfolio).filter_by(symbol=symbol).first()
+    if row is None:
+        row = Portfolio(symbol=symbol)
+        _reset(row)
+        db.add(row)
+    elif row.trade_count is None:
+        _reset(row)
+    return row
+
+def apply_transaction(db: Session, transaction: Transaction):
+    """Fold a newly added transaction into its ledger row; the caller commits both together
+
+    Back-dated trades change the average-cost history, so those replay the
+    symbol instead.
+    """
+    db.flush()
+    row = _ledger_row(db, transaction.symbol)
+    if row.last_trade_date is not None and transaction.date < row.last_trade_date:
+        rebuild_symbol(db, transaction.symbol)
+        return
+    _apply(row, transaction.transaction_type, transaction.quantity, transaction.price, transaction.date)
+
+def apply_transactions(db: Session, transactions):
+    """Fold many new transactions (dicts) into the ledger with one read and one upsert"""
+    by_symbol = {}
+    for t in transactions:
+        by_symbol.setdefault(t['symbol'], []).append(t)
+    if not by_symbol:
+        return
+
+    db.flush()
+    columns = [getattr(Portfolio, c) for c in LEDGER_COLUMNS]
+    existing = {
+        row.symbol: SimpleNamespace(**row._asdict())
+        for row in db.query(*columns).filter(Portfolio.symbol.in_(list(by_symbol)))
+    }
+
+    updated = []
+    for symbol, trades in by_symbol.items():
+        trades.sort(key=lambda t: t['date'])
+        row = existing.get(symbol)
+        if row is None:
+            row = SimpleNamespace(symbol=symbol)
+            _reset(row)
+        elif row.trade_count is None or (row.last_trade_date is not None and trades[0]['date'] < row.last_trade_date):
+            rebuild_symbol(db, symbol)
+            continue
+        for t in trades:
+            _apply(row, t['transaction_type'], t['quantity'], t['price'], t['date'])
+        row.updated_at = datetime.utcnow()
+        updated.append(vars(row))
+
+    upsert(db, Portfolio, updated, ['symbol'], [c for c in LEDGER_COLUMNS if c != 'symbol'] + ['updated_at'])
+
+def rebuild_symbol(db: Session, symbol: str):
+    """Replay one symbol's transactions into its ledger row"""
+    db.flush()
+    transactions = db.query(Transaction).filter_by(symbol=symbol).order_by(Transaction.date, Transaction.id).all()
+    row = _ledger_row(db, symbol)
+    _reset(row)
+    for t in transactions:
+        _apply(row, t.transaction_type, t.quantity, t.price, t.date)
+    if not transactions:
+        # A row _ledger_row just added was never flushed, so there is nothing to delete
+        if inspect(row).pending:
+            db.expunge(row)
+        else:
+            db.delete(row)
+
+def rebuild_ledger(db: Session):
+    """Replay the whole transaction history into the ledger"""
+    db.flush()
+    symbols = {s for (s,) in db.query(Transaction.symbol).distinct()}
+    symbols |= {s for (s,) in db.query(Portfolio.symbol)}
+    for symbol in sorted(symbols):
+        rebuild_symbol(db, symbol)
+
+    setting = db.query(Settings).filter_by(key='ledger_version').first()
+    if setting:
+        setting.value = LEDGER_VERSION
+    else:
+        db.add(Settings(key='ledger_version', value=LEDGER_VERSION))
+
+def ensure_ledger(db: Session):
+    """Rebuild the ledger once when it predates the current LEDGER_VERSION"""
+    setting = db.query(Settings).filter_by(key='ledger_version').first()
+    if setting and setting.value == LEDGER_VERSION:
+        return False
+    rebuild_ledger(db)
+    db.commit()
+    return True
+
+def check_ledger(db: Session):
+    """Compare the ledger against positions recomputed from transactions; returns mismatches"""
+    expected = aggregate_positions(db)
+    actual = load_positions(db)
+    mismatches = []
+    for symbol in sorted(set(expected) | set(actual)):
+        want = expected.get(symbol, EMPTY_POSITION)
+        got = actual.get(symbol, EMPTY_POSITION)
+        if want != got:
+            mismatches.append({'symbol': symbol, 'ledger': got, 'transactions': want})
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Position ledger maintenance")
+    parser.add_argument('command', choices=['check', 'rebuild'])
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == 'rebuild':
+            rebuild_ledger(db)
+            db.commit()
+            print("✅ Ledger rebuilt")
+        mismatches = check_ledger(db)
+        for m in mismatches:
+            print(f"❌ {m['symbol']}: ledger {m['ledger']} != transactions {m['transactions']}")
+        if not mismatches:
+            print("✅ Ledger consistent with transaction history")
+        raise SystemExit(1 if mismatches else 0)
+    finally:
+        db.close()
@@ -0,0 +1,289 @@
+import yfinance as yf
+import pandas as pd
+from datetime import datetime
+import argparse
+import json
+import os
+import threading
+
+from resilience import call_with_retry, for_host, UpstreamUnavailable, CircuitOpenError
+
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# 'yfinance' (live, failing over to replay) or 'replay' (offline only)
+MARKET_DATA_PROVIDER = os.getenv('MARKET_DATA_PROVIDER', 'yfinance')
+REPLAY_DIR = os.getenv('REPLAY_DIR', './replay')
+# Save every successful live response into REPLAY_DIR
+REPLAY_RECORD = os.getenv('REPLAY_RECORD', '0') == '1'
+
+class YFinanceProvider:
+    """Live data from Yahoo Finance"""
+    name = 'yfinance'
+    host = 'finance.yahoo.com'
+
+    def __init__(self, timeout=20):
+        self.timeout = timeout
+
+    def download(self, symbols, **kwargs):
+        """OHLCV for several symbols with one yf.download call, split into {symbol: DataFrame}
+
+        Used by the recorder below; the app goes through FailoverProvider,
+        which calls history() per symbol so errors are not swallowed.
+        """
+        data = yf.download(
+            list(symbols),
+            group_by='ticker',
+            auto_adjust=True,
+            actions=False,
+            # One request per symbol in turn; parallelism comes from the FETCH_WORKERS pool
+            threads=False,
+            progress=False,
+            timeout=self.timeout,
+            **kwargs
+        )
+        frames = {}
+        if data is None or data.empty:
+            return frames
+
+        if isinstance(data.columns, pd.MultiIndex):
+            available = set(data.columns.get_level_values(0))
+            for symbol in symbols:
+                if symbol in available:
+                    frames[symbol] = data[symbol][BAR_COLUMNS].dropna(subset=['Close'])
+        elif len(symbols) == 1:
+            frames[symbols[0]] = data[BAR_COLUMNS].dropna(subset=['Close'])
+        return frames
+
+    def history(self, symbol, **kwargs):
+        """OHLCV for one symbol
+
+        yf.download makes this same request per symbol but swallows every
+        error; here a rate limit raises YFRateLimitError, while most other
+        failures still come back as an empty frame.
+        """
+        frame = yf.Ticker(symbol).history(auto_adjust=True, actions=False, timeout=self.timeout, **kwargs)
+        if frame is None or frame.empty:
+            return None
+        frame = frame[BAR_COLUMNS].dropna(subset=['Close'])
+        if frame.empty:
+            return None
+        # Exchange-local dates, tz-naive like yf.download returns them
+        if frame.index.tz is not None:
+            frame.index = frame.index.tz_localize(None)
+        return frame
+
+    def info(self, symbol):
+        return yf.Ticker(symbol).info or {}
+
+    def news(self, symbol):
+        return yf.Ticker(symbol).news or []
+
+class ReplayProvider:
+    """Recorded data served from files: <dir>/<SYMBOL>.history.csv, .info.json and .news.json
+
+    Deterministic and offline, for load tests and benchmarks, and the
+    fallback while the live provider is failing.
+    """
+    name = 'replay'
+
+    def __init__(self, directory=REPLAY_DIR):
+        self.directory = directory
+        self._histories = {}
+        self._lock = threading.Lock()
+
+    def _path(self, symbol, kind):
+        return os.path.join(self.directory, f"{symbol}.{kind}")
+
+    def _history(self, symbol):
+        with self._lock:
+            if symbol not in self._histories:
+                path = self._path(symbol, 'history.csv')
+                if os.path.exists(path):
+                    frame = pd.read_csv(path, index_col='Date', parse_dates=['Date'])
+                    self._histories[symbol] = frame[BAR_COLUMNS]
+                else:
+                    self._histories[symbol] = None
+            return self._histories[symbol]
+
+    def _json(self, symbol, kind, default):
+        path = self._path(symbol, kind)
+        if not os.path.exists(path):
+            return default
+        with open(path) as f:
+            return json.load(f)
+
+    def has(self, symbol):
+        return os.path.exists(self._path(symbol, 'history.csv'))
+
+    def download(self, symbols, period=None, start=None, **kwargs):
+        if start is None and period:
+            years = int(period[:-1]) if period.endswith('y') else 5
+            start = pd.Timestamp.today().normalize() - pd.DateOffset(years=years)
+        frames = {}
+        for symbol in symbols:
+            frame = self._history(symbol)
+            if frame is None:
+                continue
+            if start is not None:
+                frame = frame[frame.index >= pd.Timestamp(start)]
+            if not frame.empty:
+                frames[symbol] = frame
+        return frames
+
+    def history(self, symbol, **kwargs):
+        return self.download([symbol], **kwargs).get(symbol)
+
+    def info(self, symbol):
+        return self._json(symbol, 'info.json', {})
+
+    def news(self, symbol):
+        return self._json(symbol, 'news.json', [])
+
+    def save_history(self, symbol, frame):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(symbol, 'history.csv')
+        existing = self._history(symbol)
+        if existing is not None:
+            frame = pd.concat([existing[existing.index < frame.index.min()], frame]) if len(frame) else existing
+        out = frame[BAR_COLUMNS].copy()
+        out.index = pd.DatetimeIndex(out.index).tz_localize(None).normalize()
+        out.index.name = 'Date'
+        out.to_csv(path)
+        with self._lock:
+            self._histories[symbol] = out
+
+    def save_json(self, symbol, kind, data):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(symbol, f"{kind}.json"), 'w') as f:
+            json.dump(data, f, default=str)
+
+class FailoverProvider:
+    """Live provider behind its host's rate limiter and circuit breaker, with replay as the fallback
+
+    Live calls take a token from the host's adaptive token bucket and are
+    retried with jittered backoff on 429/5xx. Calls that still fail count
+    towards the host's circuit breaker; while it is open (or a call could
+    not be made in time) requests are answered from replay, and when replay
+    has nothing either the call raises, so caches keep serving what they
+    already hold. Downloads make one such call per symbol, the request
+    yfinance would make anyway. A symbol that comes back without bars
+    (delisted, mistyped) is a miss for that symbol only: replay fills it in
+    if it can, and the breaker counts neither a success nor a failure.
+    """
+
+    def __init__(self, live, replay, record=False):
+        self.live = live
+        self.replay = replay
+        self.record = record
+        self.limiter, self.breaker = for_host(getattr(live, 'host', live.name))
+
+    @property
+    def name(self):
+        return self.replay.name if self.failed_over else self.live.name
+
+    @property
+    def failed_over(self):
+        return self.breaker.state == 'open'
+
+    def _fallback(self, method, arg, error, **kwargs):
+        result = getattr(self.replay, method)(arg, **kwargs)
+        # Missing bars just leave the stored history as it is; info and news fall back to the caches
+        if method != 'history' and not result:
+            if isinstance(error, Exception):
+                raise error
+            raise UpstreamUnavailable(error)
+        return result, False
+
+    def _call(self, method, arg, **kwargs):
+        """(result, True) from live, or (result, False) when replay answered instead"""
+        if not self.breaker.allow():
+            return self._fallback(method, arg, CircuitOpenError(f"{self.breaker.host} circuit open"), **kwargs)
+        try:
+            result = call_with_retry(lambda: getattr(self.live, method)(arg, **kwargs), self.limiter)
+        except UpstreamUnavailable as e:
+            self.breaker.release()
+            return self._fallback(method, arg, e, **kwargs)
+        except Exception as e:
+            self.breaker.failure(e)
+            return self._fallback(method, arg, e, **kwargs)
+        if method == 'history' and result is None:
+            # Let the next call be the half-open trial if this one was
+            self.breaker.release()
+            return self._fallback(method, arg, 'no bars', **kwargs)
+        self.breaker.success()
+        return result, True
+
+    def download(self, symbols, **kwargs):
+        frames = {}
+        for symbol in symbols:
+            frame, live = self._call('history', symbol, **kwargs)
+            if frame is None or frame.empty:
+                continue
+            frames[symbol] = frame
+            if live and self.record:
+                self.replay.save_history(symbol, frame)
+        return frames
+
+    def info(self, symbol):
+        result, live = self._call('info', symbol)
+        if live and self.record and result:
+            self.replay.save_json(symbol, 'info', result)
+        return result
+
+    def news(self, symbol):
+        result, live = self._call('news', symbol)
+        if live and self.record and result:
+            self.replay.save_json(symbol, 'news', result)
+        return result
+
+    def status(self):
+        breaker = self.breaker.status()
+        return {
+            "provider": self.name,
+            "live": self.live.name,
+            "failed_over": self.failed_over,
+            "circuit": breaker['state'],
+            "consecutive_failures": breaker['consecutive_failures'],
+            "failovers": breaker['opened'],
+            "retry_in": breaker['retry_in'],
+            "rate_limit": round(self.limiter.rate, 2),
+            "replay_dir": self.replay.directory,
+            "recording": self.record,
+        }
+
+def create_provider(timeout=20):
+    replay = ReplayProvider(REPLAY_DIR)
+    if MARKET_DATA_PROVIDER == 'replay':
+        return replay
+    return FailoverProvider(YFinanceProvider(timeout), replay, record=REPLAY_RECORD)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record live market data for the replay provider")
+    parser.add_argument('symbols', nargs='*', help="symbols to record (default: every watchlist ticker)")
+    parser.add_argument('--dir', default=REPLAY_DIR)
+    parser.add_argument('--period', default='5y')
+    args = parser.parse_args()
+
+    symbols = [s.upper() for s in args.symbols]
+    if not symbols:
+        from database import SessionLocal, Ticker
+        db = SessionLocal()
+        try:
+            symbols = [t.symbol for t in db.query(Ticker).all()]
+        finally:
+            db.close()
+
+    live = YFinanceProvider()
+    replay = ReplayProvider(args.dir)
+    frames = live.download(symbols, period=args.period)
+    for symbol in symbols:
+        if symbol in frames:
+            replay.save_history(symbol, frames[symbol])
+        try:
+            replay.save_json(symbol, 'info', live.info(symbol))
+            replay.save_json(symbol, 'news', live.news(symbol))
+        except Exception as e:
+            print(f"❌ {symbol}: {e}")
+            continue
+        print(f"✅ {symbol}: {len(frames.get(symbol, []))} bars")
+    print(f"Recorded {len(symbols)} symbols in {args.dir} at {datetime.now():%Y-%m-%d %H:%M}")
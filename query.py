@@ -0,0 +1,129 @@
+import math
+import operator
+import re
+
+from indicators import PERF_WINDOWS, MA_WINDOWS
+
+OPERATORS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    '=': operator.eq, '==': operator.eq, '!=': operator.ne,
+}
+FILTER_PATTERN = re.compile(r'^\s*([\w.]+)\s*(<=|>=|!=|==|=|<|>)\s*(.*?)\s*$')
+
+def _number(value):
+    if value is None or isinstance(value, str):
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+def _metric(name):
+    return lambda row, m: _number(m.get(name))
+
+def _stat(name):
+    return lambda row, m: _number(row['stats'].get(name))
+
+# Queryable fields: raw indicator values come from the snapshot metrics,
+# the rest from the already built screener row
+FIELDS = {
+    'symbol': lambda row, m: row['symbol'],
+    'category': lambda row, m: row['category'],
+    'sector': lambda row, m: row['stats'].get('sector'),
+    'sentiment': lambda row, m: row['sentiment'],
+    'price': _metric('price'),
+    'yesterday': _metric('yesterday'),
+    'rsi': _metric('rsi'),
+    'avg_volume': _metric('avg_volume'),
+    'volatility': _metric('volatility'),
+    'pe': _stat('pe'),
+    'eps': _stat('eps'),
+    'beta': _stat('beta'),
+    'dividend_yield': _stat('dividend_yield'),
+    '52w_high': _stat('52w_high'),
+    '52w_low': _stat('52w_low'),
+    'quantity': lambda row, m: row['position']['quantity'],
+    'avg_price': lambda row, m: row['position']['avg_price'],
+    'value': lambda row, m: row['position']['current_value'],
+    'pnl': lambda row, m: row['position']['pnl'],
+    'pnl_pct': lambda row, m: row['position']['pnl_pct'],
+    'alert_triggered': lambda row, m: row['alert_triggered'],
+}
+for _name in PERF_WINDOWS:
+    FIELDS[f'perf_{_name}'] = FIELDS[_name] = _metric(f'perf_{_name}')
+for _window in MA_WINDOWS:
+    FIELDS[f'ma{_window}'] = FIELDS[f'ma_{_window}'] = _metric(f'ma_{_window}')
+
+def parse_filter(expression):
+    """Parse `field<op>value` where value is a number, another field or (for =/!=) text"""
+    match = FILTER_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter: {expression}")
+    name, op, value = match.groups()
+    if name not in FIELDS:
+        raise ValueError(f"Unknown field: {name}")
+
+    if value in FIELDS:
+        right = FIELDS[value]
+    else:
+        try:
+            number = float(value)
+            right = lambda row, m: number
+        except ValueError:
+            if op not in ('=', '==', '!='):
+                raise ValueError(f"Invalid filter value: {expression}")
+            right = lambda row, m: value
+    return FIELDS[name], OPERATORS[op], right
+
+def _matches(row, m, filters):
+    for left, compare, right in filters:
+        a, b = left(row, m), right(row, m)
+        if a is None or b is None:
+            return False
+        try:
+            if not compare(a, b):
+                return False
+        except TypeError:
+            return False
+    return True
+
+def project(row, fields):
+    """Copy of row with only the given top-level or dotted (`stats.rsi`) fields"""
+    out = {'symbol': row['symbol']}
+    for path in fields:
+        keys = path.split('.')
+        value = row
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = out
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = value
+    return out
+
+def query_rows(rows, metrics, filters=(), sort=None, descending=False, offset=0, limit=None, fields=None):
+    """Filter, sort, page and project screener rows
+
+    `metrics` is the snapshot's {symbol: raw indicator values}, so filters
+    and sorting use unrounded values and nothing is recomputed. Returns
+    (total matching rows, page). Raises ValueError for bad parameters.
+    """
+    parsed = [parse_filter(f) for f in filters]
+    matched = [row for row in rows if _matches(row, metrics.get(row['symbol'], {}), parsed)]
+
+    if sort:
+        if sort not in FIELDS:
+            raise ValueError(f"Unknown sort field: {sort}")
+        key = FIELDS[sort]
+        keyed = [(key(row, metrics.get(row['symbol'], {})), row) for row in matched]
+        # Rows without a value go last in either direction
+        present = [item for item in keyed if item[0] is not None]
+        present.sort(key=lambda item: item[0], reverse=descending)
+        matched = [row for _, row in present] + [row for value, row in keyed if value is None]
+
+    total = len(matched)
+    page = matched[offset:offset + limit if limit is not None else None]
+    if fields:
+        page = [project(row, fields) for row in page]
+    return total, page
@@ -0,0 +1,234 @@
+from contextlib import contextmanager
+import os
+import random
+import threading
+import time
+
+from metrics import counter, histogram, register_collector
+
+# Upstream requests per second (adapted down on 429s, back up on successes) and burst size
+UPSTREAM_RATE = float(os.getenv('UPSTREAM_RATE', '10'))
+UPSTREAM_BURST = float(os.getenv('UPSTREAM_BURST', '20'))
+UPSTREAM_MIN_RATE = float(os.getenv('UPSTREAM_MIN_RATE', '0.5'))
+# Longest a call waits for a token before giving up
+RATE_WAIT_MAX = float(os.getenv('RATE_WAIT_MAX', '10'))
+# Attempts per call on 429/5xx/connection errors, with full-jitter exponential backoff
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', '3'))
+RETRY_BASE = float(os.getenv('RETRY_BASE', '0.5'))
+RETRY_MAX = float(os.getenv('RETRY_MAX', '8'))
+# Consecutive failures that open a host's circuit, and how long it stays open
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', os.getenv('FAILOVER_THRESHOLD', '3')))
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', os.getenv('FAILOVER_COOLDOWN', '300')))
+
+retries = counter('upstream_retries_total', "Upstream calls retried after a 429/5xx/connection error", ('host', 'reason'))
+rate_wait_seconds = histogram('upstream_rate_wait_seconds', "Time spent waiting for a rate limiter token", ('host',),
+                              buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+class UpstreamUnavailable(Exception):
+    """The call was not attempted: circuit open, no token in time or deadline passed"""
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+_deadline = threading.local()
+
+@contextmanager
+def deadline(at):
+    """Bound every rate-limit wait and retry in this thread by time.monotonic() deadline `at`"""
+    previous = getattr(_deadline, 'at', None)
+    _deadline.at = at if previous is None or at is None else min(at, previous)
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+def remaining():
+    """Seconds left before this thread's deadline, or None without one"""
+    at = getattr(_deadline, 'at', None)
+    return None if at is None else at - time.monotonic()
+
+class TokenBucket:
+    """Token-bucket rate limiter with AIMD adaptation
+
+    Throttling responses halve the refill rate (down to `min_rate`); every
+    success adds back a fiftieth of the configured rate.
+    """
+
+    def __init__(self, host, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, min_rate=UPSTREAM_MIN_RATE):
+        self.host = host
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=RATE_WAIT_MAX):
+        """Take a token, waiting up to timeout (and the thread's deadline); False if none came"""
+        started = time.monotonic()
+        left = remaining()
+        if left is not None:
+            timeout = min(timeout, left)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    rate_wait_seconds.observe(now - started, host=self.host)
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait - started > timeout:
+                return False
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` consecutive failures -> half-open after `cooldown`
+
+    While open, allow() is False and callers serve cached or replayed data.
+    Half-open lets one trial call through; its success closes the circuit
+    and its failure opens it for another cooldown.
+    """
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = 0
+        self.retry_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.retry_at == 0:
+            return 'closed'
+        return 'open' if time.monotonic() < self.retry_at else 'half_open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.retry_at:
+                print(f"✅ {self.host} recovered, circuit closed")
+            self.failures = 0
+            self.retry_at = 0.0
+            self._trial = False
+
+    def release(self):
+        """The call allow() let through was never made; let the next one be the trial"""
+        with self._lock:
+            self._trial = False
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            reopen = self._trial
+            self._trial = False
+            if reopen or (self.retry_at == 0 and self.failures >= self.threshold):
+                self.opened += 1
+                self.retry_at = time.monotonic() + self.cooldown
+                print(f"⚠️ {self.host} failed {self.failures} times ({error}); circuit open for {self.cooldown:.0f}s")
+
+    def status(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "retry_in": max(round(self.retry_at - time.monotonic(), 1), 0) if self.retry_at else 0,
+        }
+
+def status_code(error):
+    """HTTP status behind an upstream exception, when there is one"""
+    response = getattr(error, 'response', None)
+    for code in (getattr(response, 'status_code', None), getattr(error, 'status_code', None), getattr(error, 'code', None)):
+        if isinstance(code, int):
+            return code
+    if type(error).__name__ == 'YFRateLimitError' or 'Too Many Requests' in str(error):
+        return 429
+    return None
+
+def retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error):
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or 500 <= code < 600
+    name = type(error).__name__
+    return isinstance(error, (TimeoutError, ConnectionError)) or 'Timeout' in name or 'Connection' in name
+
+def call_with_retry(fn, limiter: TokenBucket, attempts=RETRY_ATTEMPTS):
+    """fn() through the rate limiter, retried with full-jitter exponential backoff on retryable errors"""
+    for attempt in range(attempts):
+        if not limiter.acquire():
+            raise UpstreamUnavailable(f"{limiter.host}: no rate limit token in time")
+        try:
+            result = fn()
+        except Exception as e:
+            code = status_code(e)
+            if code == 429:
+                limiter.throttled()
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            delay = retry_after(e) or random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+            left = remaining()
+            if left is not None and delay >= left:
+                raise
+            retries.inc(host=limiter.host, reason=str(code or type(e).__name__))
+            time.sleep(delay)
+            continue
+        limiter.succeeded()
+        return result
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+def for_host(host):
+    """(TokenBucket, CircuitBreaker) shared by every client of one upstream host"""
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = (TokenBucket(host), CircuitBreaker(host))
+        return _hosts[host]
+
+@register_collector
+def _resilience_metrics():
+    with _hosts_lock:
+        hosts = dict(_hosts)
+    states = {'closed': 0, 'half_open': 1, 'open': 2}
+    return [
+        ('circuit_state', 'gauge', "Upstream circuit: 0 closed, 1 half-open, 2 open",
+         [({'host': h}, states[b.state]) for h, (_, b) in hosts.items()]),
+        ('circuit_opened_total', 'counter', "Times the upstream circuit opened",
+         [({'host': h}, b.opened) for h, (_, b) in hosts.items()]),
+        ('upstream_rate_limit', 'gauge', "Current adaptive upstream request rate (per second)",
+         [({'host': h}, round(l.rate, 3)) for h, (l, _) in hosts.items()]),
+    ]
@@ -0,0 +1,346 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dt_time
+from types import MappingProxyType
+from zoneinfo import ZoneInfo
+import asyncio
+import os
+import threading
+import time
+
+from database import SessionLocal, Ticker
+from indicators import PERF_WINDOWS
+from market_data import fetch_all, update_indicators
+from metrics import timed, register_collector
+from shared import store, leadership, watch, changed, poll, SHARED_POLL
+
+# Refresh cadence while the market is open, and the slower one outside trading hours
+REFRESH_INTERVAL = float(os.getenv('REFRESH_INTERVAL', '60'))
+REFRESH_INTERVAL_CLOSED = float(os.getenv('REFRESH_INTERVAL_CLOSED', '1800'))
+MARKET_TZ = ZoneInfo(os.getenv('MARKET_TZ', 'America/New_York'))
+MARKET_OPEN = dt_time(9, 30)
+MARKET_CLOSE = dt_time(16, 0)
+# Keep refreshing for a while after the close so the final bar is captured
+MARKET_CLOSE_GRACE = 30 * 60
+# A queued symbol whose download did not finish is not queued again for this long
+QUEUE_RETRY = float(os.getenv('QUEUE_RETRY', '30'))
+
+def format_earnings_date(earnings_date):
+    try:
+        if isinstance(earnings_date, (int, float)):
+            dt = datetime.fromtimestamp(earnings_date)
+        elif isinstance(earnings_date, str):
+            dt = datetime.fromisoformat(earnings_date.replace('Z', '+00:00'))
+        else:
+            dt = earnings_date
+
+        now = datetime.now()
+        if dt.date() < now.date():
+            return f"{dt.strftime('%b %d, %Y')} (Past)"
+        elif dt.date() == now.date():
+            return "Today"
+        else:
+            days_until = (dt.date() - now.date()).days
+            if days_until == 1:
+                return "Tomorrow"
+            elif days_until <= 7:
+                return f"In {days_until} days ({dt.strftime('%b %d')})"
+            else:
+                return dt.strftime('%b %d, %Y')
+    except:
+        return None
+
+def build_market_row(m, info):
+    """Market-data part of a screener row (everything except the user's own data)"""
+    current_price = m['price']
+    ma50 = m['ma_50']
+    ma100 = m['ma_100']
+    ma250 = m['ma_250']
+    rsi = round(m['rsi'], 2) if not np.isnan(m['rsi']) else '—'
+    avg_volume = m['avg_volume']
+    volatility = m['volatility']
+
+    earnings_date_display = None
+    try:
+        if 'earningsDate' in info and info['earningsDate']:
+            earnings_date = info['earningsDate']
+            if isinstance(earnings_date, list) and len(earnings_date) > 0:
+                earnings_date_display = format_earnings_date(earnings_date[0])
+    except:
+        pass
+
+    market_cap = info.get('marketCap', 0)
+    if market_cap >= 1e12:
+        market_cap_display = f"${market_cap/1e12:.2f}T"
+    elif market_cap >= 1e9:
+        market_cap_display = f"${market_cap/1e9:.2f}B"
+    elif market_cap >= 1e6:
+        market_cap_display = f"${market_cap/1e6:.2f}M"
+    else:
+        market_cap_display = "—"
+
+    dividend_yield = info.get('dividendYield', 0)
+    dividend_yield_display = round(dividend_yield * 100, 2) if dividend_yield and dividend_yield > 0 else 0
+
+    return {
+        "price": round(current_price, 2),
+        "yesterday": round(m['yesterday'], 2),
+        "perf": {name: m[f'perf_{name}'] for name in PERF_WINDOWS},
+        "ma": {
+            "50": round(ma50, 2) if not np.isnan(ma50) else "—",
+            "100": round(ma100, 2) if not np.isnan(ma100) else "—",
+            "250": round(ma250, 2) if not np.isnan(ma250) else "—"
+        },
+        "stats": {
+            "pe": round(info.get('trailingPE', 0), 2) if info.get('trailingPE') else '—',
+            "rsi": rsi,
+            "eps": round(info.get('trailingEps', 0), 2) if info.get('trailingEps') else '—',
+            "beta": round(info.get('beta', 0), 2) if info.get('beta') else '—',
+            "sector": info.get('sector', '—'),
+            "earnings": earnings_date_display,
+            "avg_volume": round(avg_volume, 0) if not np.isnan(avg_volume) else '—',
+            "volatility": round(volatility, 2) if not np.isnan(volatility) else '—',
+            "market_cap": market_cap_display,
+            "52w_high": round(info.get('fiftyTwoWeekHigh', 0), 2) if info.get('fiftyTwoWeekHigh') else '—',
+            "52w_low": round(info.get('fiftyTwoWeekLow', 0), 2) if info.get('fiftyTwoWeekLow') else '—',
+            "dividend_yield": dividend_yield_display
+        },
+        "sentiment": "Bullish" if current_price > ma250 else "Bearish"
+    }
+
+class Snapshot:
+    """Immutable precomputed screener state, replaced wholesale on every refresh
+
+    `rows` maps symbol to its formatted market row and `metrics` to the raw
+    indicator values behind it; `symbols` is every symbol the refresh
+    finished, including those that produced no row. Symbols whose download
+    did not finish in time are left out, so they are computed again.
+    """
+    __slots__ = ('rows', 'metrics', 'symbols', 'created_at', 'version')
+
+    def __init__(self, rows, metrics, symbols, created_at, version):
+        object.__setattr__(self, 'rows', MappingProxyType(dict(rows)))
+        object.__setattr__(self, 'metrics', MappingProxyType(dict(metrics)))
+        object.__setattr__(self, 'symbols', frozenset(symbols))
+        object.__setattr__(self, 'created_at', created_at)
+        object.__setattr__(self, 'version', version)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is immutable")
+
+_snapshot = Snapshot({}, {}, [], None, 0)
+_refresh_lock = threading.Lock()
+_listeners = []
+# Symbols requested before any snapshot had them, computed one batch at a time off the request path
+_queued = set()
+_attempted = {}  # symbol -> time.monotonic() of its last queued computation
+_requested = set()  # symbols a follower asked the leader for since it last adopted a snapshot
+_queue_lock = threading.Lock()
+_queue_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot-queue')
+
+def on_publish(callback):
+    """Call callback(snapshot) every time a new snapshot is published"""
+    _listeners.append(callback)
+
+def current_snapshot():
+    return _snapshot
+
+def compute_rows(symbols):
+    """Fetch, update indicators and build market rows for the given symbols
+
+    Returns (rows, metrics) for the symbols with enough history, and the
+    symbols that count as done: those whose bars were fetched, plus those
+    that got a row from stored bars anyway. The rest are retried on the
+    next request.
+    """
+    with timed('fetch'):
+        infos, unfinished = fetch_all(symbols)
+    with timed('indicators'):
+        metrics = update_indicators(symbols)
+    rows = {}
+    with timed('rows'):
+        for symbol in symbols:
+            try:
+                m = metrics.get(symbol)
+                if not m or m['bars'] < 50:
+                    continue
+                rows[symbol] = build_market_row(m, infos.get(symbol, {}))
+            except Exception as e:
+                print(f"Error: {symbol}: {e}")
+    done = [symbol for symbol in symbols if symbol in rows or symbol not in unfinished]
+    return rows, {symbol: metrics[symbol] for symbol in rows}, done
+
+def _publish(rows, metrics, symbols, merge):
+    global _snapshot
+    old = _snapshot
+    if merge:
+        rows = {**old.rows, **rows}
+        metrics = {**old.metrics, **metrics}
+        symbols = old.symbols | set(symbols)
+    _snapshot = Snapshot(rows, metrics, symbols, datetime.utcnow(), old.version + 1)
+    for callback in _listeners:
+        callback(_snapshot)
+    # Shared after the listeners ran, so alert events are persisted before followers look for them
+    if leadership.is_leader:
+        _share(_snapshot)
+    return _snapshot
+
+def _share(snapshot):
+    try:
+        store.set('snapshot', 'current', (dict(snapshot.rows), dict(snapshot.metrics), list(snapshot.symbols),
+                                          snapshot.created_at, snapshot.version))
+        changed('snapshot')
+    except Exception as e:
+        print(f"Sharing snapshot v{snapshot.version} failed: {e}")
+
+def load_shared_snapshot():
+    """Adopt the snapshot the leader last shared; followers call this whenever it changes"""
+    global _snapshot
+    if leadership.is_leader and _snapshot.version:
+        return False
+    shared = store.get('snapshot', 'current')
+    if shared is None:
+        return False
+    rows, metrics, symbols, created_at, version = shared[0]
+    with _refresh_lock:
+        if _snapshot.created_at == created_at and _snapshot.version == version:
+            return False
+        _snapshot = Snapshot(rows, metrics, symbols, created_at, version)
+    with _queue_lock:
+        # Anything still missing from this snapshot may be asked for again
+        _requested.clear()
+    for callback in _listeners:
+        callback(_snapshot)
+    return True
+
+watch('snapshot', load_shared_snapshot)
+
+def refresh_snapshot():
+    """Recompute the whole watchlist and publish it as the new snapshot"""
+    db = SessionLocal()
+    try:
+        symbols = [t.symbol for t in db.query(Ticker).all()]
+    finally:
+        db.close()
+
+    with _refresh_lock, timed('refresh'):
+        rows, metrics, done = compute_rows(symbols)
+        return _publish(rows, metrics, done, merge=False)
+
+def ensure_snapshot(symbols):
+    """Current snapshot, queueing any symbols it has never seen (e.g. just added)
+
+    Never waits for upstream data: queued symbols get their rows in a
+    later snapshot, which is pushed to the streams when it is published.
+    """
+    snapshot = _snapshot
+    missing = [s for s in symbols if s not in snapshot.symbols]
+    if missing:
+        queue_symbols(missing)
+    return snapshot
+
+def queue_symbols(symbols):
+    """Compute symbols missing from the snapshot in the background and merge them in
+
+    Only the leader computes (a lone process becomes it); other workers ask
+    it to through the shared store and pick the rows up with its next
+    snapshot, so a single process fetches upstream data and writes bars.
+    """
+    if not leadership.acquire():
+        with _queue_lock:
+            new = [s for s in symbols if s not in _requested]
+            _requested.update(new)
+        if new:
+            changed('queued')
+        return
+
+    now = time.monotonic()
+    with _queue_lock:
+        new = [s for s in symbols if s not in _queued and now - _attempted.get(s, -QUEUE_RETRY) >= QUEUE_RETRY]
+        if not new:
+            return
+        _queued.update(new)
+    _queue_pool.submit(_compute_queued)
+
+def _compute_queued():
+    with _queue_lock:
+        symbols = sorted(_queued)
+        now = time.monotonic()
+        for s in symbols:
+            _attempted[s] = now
+    try:
+        # After any running full refresh, so two refreshes never write the same symbol's bars
+        with _refresh_lock:
+            missing = [s for s in symbols if s not in _snapshot.symbols]
+            if missing:
+                with timed('refresh_queued'):
+                    rows, metrics, done = compute_rows(missing)
+                _publish(rows, metrics, done, merge=True)
+    except Exception as e:
+        print(f"Computing queued symbols failed: {e}")
+    finally:
+        with _queue_lock:
+            _queued.difference_update(symbols)
+
+def _queue_unseen():
+    """A follower asked for symbols; the leader queues every ticker its snapshot lacks"""
+    if not leadership.is_leader:
+        return
+    db = SessionLocal()
+    try:
+        symbols = [symbol for (symbol,) in db.query(Ticker.symbol)]
+    finally:
+        db.close()
+    snapshot = _snapshot
+    missing = [s for s in symbols if s not in snapshot.symbols]
+    if missing:
+        queue_symbols(missing)
+
+watch('queued', _queue_unseen)
+
+@register_collector
+def _snapshot_metrics():
+    snapshot = _snapshot
+    age = (datetime.utcnow() - snapshot.created_at).total_seconds() if snapshot.created_at else 0
+    return [
+        ('worker_leader', 'gauge', "1 in the worker that runs the refresh job", [({'pid': os.getpid()}, int(leadership.is_leader))]),
+        ('snapshot_version', 'gauge', "Snapshots published since start", [({}, snapshot.version)]),
+        ('snapshot_rows', 'gauge', "Symbols with a row in the current snapshot", [({}, len(snapshot.rows))]),
+        ('snapshot_queued', 'gauge', "Symbols waiting to be computed into the snapshot", [({}, len(_queued))]),
+        ('snapshot_age_seconds', 'gauge', "Seconds since the current snapshot was published", [({}, round(age, 1))]),
+    ]
+
+def market_is_open(now=None):
+    now = (now or datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    if now.weekday() >= 5:
+        return False
+    open_at = now.replace(hour=MARKET_OPEN.hour, minute=MARKET_OPEN.minute, second=0, microsecond=0)
+    close_at = now.replace(hour=MARKET_CLOSE.hour, minute=MARKET_CLOSE.minute, second=0, microsecond=0)
+    return open_at <= now and (now - close_at).total_seconds() <= MARKET_CLOSE_GRACE
+
+def next_refresh_delay(now=None):
+    return REFRESH_INTERVAL if market_is_open(now) else REFRESH_INTERVAL_CLOSED
+
+async def run_scheduler():
+    """Run the worker's share of the refresh job forever
+
+    The worker holding the leader lock refreshes the snapshot on a
+    market-hours aware cadence and shares it; the others pick up each new
+    snapshot and other workers' changes every SHARED_POLL seconds. A
+    follower takes over the refreshes once the leader process is gone.
+    """
+    next_refresh = 0
+    while True:
+        if leadership.acquire() and time.monotonic() >= next_refresh:
+            started = time.monotonic()
+            try:
+                snapshot = await asyncio.to_thread(refresh_snapshot)
+                print(f"🔄 Snapshot v{snapshot.version}: {len(snapshot.rows)} symbols in {time.monotonic() - started:.1f}s")
+            except Exception as e:
+                print(f"Snapshot refresh failed: {e}")
+            next_refresh = started + max(next_refresh_delay(), 1)
+        try:
+            await asyncio.to_thread(poll)
+        except Exception as e:
+            print(f"Shared store poll failed: {e}")
+        await asyncio.sleep(SHARED_POLL)
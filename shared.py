@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: one worker only, which is always the leader
+    fcntl = None
+
+# Host-local directory every worker of one deployment shares
+SHARED_DIR = os.getenv('SHARED_DIR', './shared')
+# How often each worker checks for a new snapshot or changes made by other workers
+SHARED_POLL = float(os.getenv('SHARED_POLL', '1'))
+
+class SharedStore:
+    """Pickled values and change counters in a SQLite file all workers open
+
+    Each thread gets its own connection. Values are keyed by (namespace,
+    key) and stamped with wall-clock time, so TTLs mean the same thing in
+    every process. Generations are counters a worker bumps to tell the
+    others that something they cache has changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self._ready_lock:
+                if not self._ready:
+                    conn.execute('CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, value BLOB, '
+                                 'updated_at REAL, PRIMARY KEY (namespace, key))')
+                    conn.execute('CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, value INTEGER)')
+                    self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key):
+        """(value, updated_at) or None"""
+        row = self._connection().execute(
+            'SELECT value, updated_at FROM entries WHERE namespace = ? AND key = ?', (namespace, str(key))
+        ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, namespace, key, value, updated_at=None):
+        self._connection().execute(
+            'INSERT INTO entries VALUES (?, ?, ?, ?) ON CONFLICT(namespace, key) '
+            'DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at',
+            (namespace, str(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), updated_at or time.time())
+        )
+
+    def delete(self, namespace, key):
+        self._connection().execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, str(key)))
+
+    def bump(self, name):
+        self._connection().execute(
+            'INSERT INTO generations VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,)
+        )
+
+    def generation(self, name):
+        row = self._connection().execute('SELECT value FROM generations WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def generations(self):
+        return dict(self._connection().execute('SELECT name, value FROM generations').fetchall())
+
+class Leadership:
+    """Refresh leader election with a non-blocking flock on a lock file
+
+    The worker holding the lock runs the refresh job until it exits; the
+    kernel releases the lock when the process dies, however it dies, and
+    the next worker to call acquire() takes over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def is_leader(self):
+        return self._file is not None
+
+    def acquire(self):
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            self._file = True
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        print(f"👑 Worker {os.getpid()} is the refresh leader")
+        return True
+
+@contextmanager
+def exclusive(name):
+    """Blocking cross-process lock, e.g. so only one worker migrates the database at startup"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    with open(os.path.join(SHARED_DIR, f"{name}.lock"), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+store = SharedStore(os.path.join(SHARED_DIR, 'shared.db'))
+leadership = Leadership(os.path.join(SHARED_DIR, 'leader.lock'))
+
+_watchers = {}
+_seen = {}
+
+def watch(name, callback):
+    """Call callback() whenever generation `name` is bumped, by any worker"""
+    _watchers.setdefault(name, []).append(callback)
+
+def changed(name):
+    """Tell every worker (this one included) that `name` changed"""
+    try:
+        store.bump(name)
+    except sqlite3.Error as e:
+        print(f"Shared store unavailable: {e}")
+
+def generation(name):
+    """How many times any worker has called changed(name); None while the store is unavailable"""
+    try:
+        return store.generation(name)
+    except sqlite3.Error as e:
+        print(f"Shared store unavailable: {e}")
+        return None
+
+def poll():
+    """Run the watchers of every generation bumped since the last poll (all of them on the first poll)"""
+    generations = store.generations()
+    for name, callbacks in _watchers.items():
+        generation = generations.get(name, 0)
+        if _seen.get(name) == generation:
+            continue
+        _seen[name] = generation
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Shared watcher for {name} failed: {e}")
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Point the app at a throwaway database, shared store and replay directory before anything imports it
+_workdir = tempfile.mkdtemp(prefix='pulse-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ['SHARED_DIR'] = os.path.join(_workdir, 'shared')
+os.environ['REPLAY_DIR'] = os.path.join(_workdir, 'replay')
+os.environ['MARKET_DATA_PROVIDER'] = 'replay'
+os.environ['ALERT_WEBHOOK_URL'] = ''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,13 @@
+import os
+
+from metrics import counter, register_collector, render
+
+def test_every_sample_is_labelled_with_the_worker():
+    counter('test_events_total', "Events seen by the test", ('kind',)).inc(kind='a')
+    register_collector(lambda: [('test_level', 'gauge', "Level seen by the test", [({}, 1)])])
+
+    samples = [line for line in render().splitlines() if line.startswith('pulse_test_')]
+
+    worker = f'worker="{os.getpid()}"'
+    assert f'pulse_test_events_total{{kind="a",{worker}}} 1' in samples
+    assert f'pulse_test_level{{{worker}}} 1' in samples
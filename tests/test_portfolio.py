@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import main
+from database import SessionLocal, Portfolio, Transaction, init_db
+from portfolio import rebuild_symbol
+
+def test_rebuild_without_transactions_or_ledger_row():
+    init_db()
+    db = SessionLocal()
+    try:
+        rebuild_symbol(db, 'NOROW')
+        db.commit()
+        assert db.query(Portfolio).filter_by(symbol='NOROW').first() is None
+    finally:
+        db.close()
+
+def test_rebuild_after_last_transaction_is_deleted():
+    init_db()
+    db = SessionLocal()
+    try:
+        trade = Transaction(symbol='GONE', transaction_type='BUY', quantity=1, price=10, date=datetime(2024, 1, 2))
+        db.add(trade)
+        rebuild_symbol(db, 'GONE')
+        db.commit()
+        assert db.query(Portfolio).filter_by(symbol='GONE').one().quantity == 1
+
+        db.delete(trade)
+        rebuild_symbol(db, 'GONE')
+        db.commit()
+        assert db.query(Portfolio).filter_by(symbol='GONE').first() is None
+    finally:
+        db.close()
+
+def test_transaction_dates_with_an_offset_are_stored_naive():
+    with TestClient(main.app) as client:
+        first = {'transaction_type': 'BUY', 'quantity': 2, 'price': 10, 'date': '2024-01-03T00:00:00'}
+        assert client.post('/api/transaction/TZ', json=first).json() == {'status': 'saved'}
+        # Back-dated with an offset, so it is compared against the naive date above
+        second = {'transaction_type': 'BUY', 'quantity': 1, 'price': 13, 'date': '2024-01-02T09:00:00+05:00'}
+        assert client.post('/api/transaction/TZ', json=second).json() == {'status': 'saved'}
+
+    db = SessionLocal()
+    try:
+        dates = [t.date for t in db.query(Transaction).filter_by(symbol='TZ').order_by(Transaction.date)]
+        assert dates == [datetime(2024, 1, 2, 4), datetime(2024, 1, 3)]
+        assert db.query(Portfolio).filter_by(symbol='TZ').one().quantity == 3
+    finally:
+        db.close()
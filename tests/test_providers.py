@@ -0,0 +1,49 @@
+import pandas as pd
+
+from providers import FailoverProvider, ReplayProvider, BAR_COLUMNS
+
+def _bars():
+    index = pd.date_range('2024-01-02', periods=5, freq='B')
+    return pd.DataFrame({c: [10.0, 11.0, 12.0, 13.0, 14.0] for c in BAR_COLUMNS}, index=index)
+
+class FakeLive:
+    """Live provider answering history() for good symbols and nothing for the rest"""
+    name = 'fake'
+
+    def __init__(self, host):
+        self.host = host
+        self.calls = []
+
+    def history(self, symbol, **kwargs):
+        self.calls.append(symbol)
+        return _bars() if symbol.startswith('GOOD') else None
+
+def test_bad_symbols_do_not_open_the_circuit(tmp_path):
+    live = FakeLive('mixed.test')
+    provider = FailoverProvider(live, ReplayProvider(str(tmp_path)))
+    symbols = ['BAD1', 'BAD2', 'BAD3', 'BAD4', 'GOOD1', 'BAD5', 'GOOD2']
+
+    frames = provider.download(symbols, period='5y')
+
+    assert sorted(frames) == ['GOOD1', 'GOOD2']
+    assert live.calls == symbols
+    assert provider.status()['circuit'] == 'closed'
+    assert provider.status()['consecutive_failures'] == 0
+
+    # Repeated refreshes still reach the live provider for the good symbols
+    assert sorted(provider.download(symbols, period='5y')) == ['GOOD1', 'GOOD2']
+    assert not provider.failed_over
+
+def test_errors_still_open_the_circuit(tmp_path):
+    class Failing(FakeLive):
+        def history(self, symbol, **kwargs):
+            self.calls.append(symbol)
+            raise ValueError("upstream broke")
+
+    live = Failing('failing.test')
+    provider = FailoverProvider(live, ReplayProvider(str(tmp_path)))
+    provider.breaker.threshold = 3
+
+    assert provider.download(['A', 'B', 'C', 'D'], period='5y') == {}
+    assert provider.failed_over
+    assert live.calls == ['A', 'B', 'C']